@@ -0,0 +1,150 @@
+"""
+Load test of the AskState endpoint, with the sandwich and sum of limits
+proofs, reporting the latency percentiles and the throughput.
+
+By default the requests go through Django in this process, with a pool of
+fake Lean servers (benchmarks/fake_lean.py) so that only the Python side is
+measured. With --url, a running server is loaded instead.
+
+Run from the root of the repository:
+    python -m benchmarks.askstate_load --concurrency 8 --requests 200
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+FAKE_LEAN = str(Path(__file__).resolve().parent / "fake_lean.py")
+
+
+def proofs():
+    from main.test_manager import (
+        sandwich_goal,
+        sandwich_hyp,
+        sandwich_proof,
+        sum_limit_goal,
+        sum_limit_hypotheses,
+        sum_limit_proof,
+    )
+
+    return [
+        ("sandwich", sandwich_hyp, sandwich_goal, sandwich_proof),
+        ("sum_limit", sum_limit_hypotheses, sum_limit_goal, sum_limit_proof),
+    ]
+
+
+def percentile(values, p):
+    """Nearest rank percentile of sorted values."""
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def django_poster():
+    import django
+    from django.test.utils import setup_test_environment
+
+    django.setup()
+    setup_test_environment()
+    from django.test import Client
+
+    def post(data):
+        response = Client().post("/ask_state/", data, content_type="application/json")
+        return response.status_code, json.loads(response.content)["status"]
+
+    return post
+
+
+def url_poster(url):
+    def post(data):
+        request = urllib.request.Request(
+            url,
+            json.dumps(data).encode(),
+            {"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.load(response)["status"]
+        except urllib.error.HTTPError as e:
+            return e.code, json.load(e)["status"]
+
+    return post
+
+
+def start_fake_pool(options):
+    from leanclient import client_wrapper
+    from leanclient.pool import LeanServerPool
+
+    lean_cmd = [
+        sys.executable,
+        FAKE_LEAN,
+        "--line-latency",
+        str(options.line_latency),
+        "--info-latency",
+        str(options.info_latency),
+    ]
+    client_wrapper._pool = LeanServerPool(options.pool_size, lean_cmd)
+    client_wrapper._pool.start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument(
+        "--line-latency",
+        type=float,
+        default=0.001,
+        help="Seconds the fake Lean takes per line of a checked file",
+    )
+    parser.add_argument(
+        "--info-latency",
+        type=float,
+        default=0,
+        help="Seconds the fake Lean takes per info request",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Send identical proofs, so that they can be answered by the cache",
+    )
+    parser.add_argument("--url", help="AskState url of a running server")
+    options = parser.parse_args()
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mapros.settings")
+    if options.url:
+        post = url_poster(options.url)
+    else:
+        post = django_poster()
+        start_fake_pool(options)
+    items = proofs()
+
+    def run(i):
+        name, hypotheses, goal, proof = random.choice(items)
+        data = {"hypotheses": hypotheses, "goal": goal, "proofs": proof}
+        # A different theorem name makes a different Lean text, not cached
+        data["name"] = name if options.cache else "{}_{}".format(name, i)
+        start = time.perf_counter()
+        result = post(data)
+        return time.perf_counter() - start, result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(options.concurrency) as executor:
+        results = list(executor.map(run, range(options.requests)))
+    duration = time.perf_counter() - start
+    latencies = sorted(latency for latency, _ in results)
+    print("requests: {}  concurrency: {}".format(options.requests, options.concurrency))
+    for p in (50, 95, 99):
+        print("p{}: {:.1f}ms".format(p, percentile(latencies, p) * 1000))
+    print("requests/s: {:.1f}".format(options.requests / duration))
+    for (code, status), count in sorted(Counter(r for _, r in results).items()):
+        print("{} {}: {}".format(code, status, count))
+
+
+if __name__ == "__main__":
+    main()
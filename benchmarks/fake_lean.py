@@ -0,0 +1,118 @@
+"""
+Fake `lean --server` speaking the JSON-lines protocol used by TrioLeanServer,
+to run the Python side of the checks without a Lean toolchain.
+
+It answers every request with canned responses after a configurable latency:
+    python benchmarks/fake_lean.py [--line-latency S] [--info-latency S]
+                                   [--state TEXT] [--error TEXT]
+                                   [--late-error TEXT] [--start-latency S]
+                                   [--unchanged] --server
+    python benchmarks/fake_lean.py --make FILE
+
+A sync of a file of n lines is "checked" in n * line-latency seconds, during
+which the file is reported in the current tasks, as Lean does. The check
+starts start-latency seconds after the response to the sync. With
+--late-error, the end of a previous check of the file, with that error, is
+reported just before the response to each sync. With --unchanged, a sync
+of the content a file already has is answered "file unchanged" and nothing
+else is sent, as Lean 3 does. With --make, only the .olean of the file is
+written.
+"""
+import argparse
+import json
+import sys
+import time
+
+
+def send(response):
+    sys.stdout.write(json.dumps(response) + "\n")
+    sys.stdout.flush()
+
+
+def task(file_name, line):
+    return {
+        "file_name": file_name,
+        "pos_line": line,
+        "pos_col": 0,
+        "end_pos_line": line,
+        "end_pos_col": 0,
+        "desc": "elaborating",
+    }
+
+
+def message(file_name, text):
+    return {
+        "file_name": file_name,
+        "pos_line": 1,
+        "pos_col": 0,
+        "severity": "error",
+        "caption": "",
+        "text": text,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", action="store_true")
+    parser.add_argument("--line-latency", type=float, default=0)
+    parser.add_argument("--info-latency", type=float, default=0)
+    parser.add_argument("--state", default="⊢ is_limit b l")
+    parser.add_argument("--error", help="Error message reported for every file")
+    parser.add_argument("--start-latency", type=float, default=0)
+    parser.add_argument("--late-error", help="Error of a previous check of the file")
+    parser.add_argument("--unchanged", action="store_true")
+    parser.add_argument("--make", help="File to compile")
+    args = parser.parse_args()
+    if args.make:
+        open(args.make[: -len(".lean")] + ".olean", "w").close()
+        return
+    contents = {}
+    for line in sys.stdin:
+        request = json.loads(line)
+        seq_num = request["seq_num"]
+        command = request["command"]
+        if command == "sync":
+            file_name = request["file_name"]
+            content = request.get("content", "")
+            if args.unchanged and contents.get(file_name) == content:
+                send(
+                    {"response": "ok", "seq_num": seq_num, "message": "file unchanged"}
+                )
+                continue
+            contents[file_name] = content
+            if args.late_error:
+                send(
+                    {
+                        "response": "all_messages",
+                        "msgs": [message(file_name, args.late_error)],
+                    }
+                )
+                send({"response": "current_tasks", "is_running": False, "tasks": []})
+            send({"response": "ok", "seq_num": seq_num, "message": "file invalidated"})
+            time.sleep(args.start_latency)
+            send(
+                {
+                    "response": "current_tasks",
+                    "is_running": True,
+                    "tasks": [task(file_name, 1)],
+                }
+            )
+            time.sleep(args.line_latency * len(content.split("\n")))
+            msgs = [message(file_name, args.error)] if args.error else []
+            send({"response": "all_messages", "msgs": msgs})
+            send({"response": "current_tasks", "is_running": False, "tasks": []})
+        elif command == "info":
+            time.sleep(args.info_latency)
+            send(
+                {
+                    "response": "ok",
+                    "seq_num": seq_num,
+                    "record": {"state": args.state},
+                }
+            )
+        else:
+            send({"response": "ok", "seq_num": seq_num})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Micro-benchmark of the framing of the Lean server output.
+
+Synthetic all_messages responses of a few megabytes are cut in chunks of the
+size of a pipe read and split into lines, once by concatenating the unfinished
+message with each chunk (the previous receiver) and once with LineBuffer.
+
+Run from the root of the repository:
+    python -m benchmarks.receiver_framing
+"""
+import json
+import time
+
+from leanclient.framing import LineBuffer
+
+CHUNK_SIZE = 65536
+
+
+def synthetic_response(size: int) -> bytes:
+    msg = {
+        "file_name": "src/result.lean",
+        "pos_line": 1,
+        "pos_col": 0,
+        "severity": "error",
+        "caption": "",
+        "text": "x" * 200,
+    }
+    count = size // len(json.dumps(msg))
+    resp = {"response": "all_messages", "msgs": [msg] * count}
+    return (json.dumps(resp) + "\n").encode()
+
+
+def chunks(data: bytes):
+    return [data[i : i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+
+
+def split_concatenating(parts):
+    unfinished_message = b""
+    result = []
+    for data in parts:
+        lines = (unfinished_message + data).split(b"\n")
+        unfinished_message = lines.pop()
+        result.extend(line.decode() for line in lines)
+    return result
+
+
+def split_line_buffer(parts):
+    buffer = LineBuffer()
+    result = []
+    for data in parts:
+        result.extend(buffer.feed(data))
+    return result
+
+
+def measure(split, parts, repeat=3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        split(parts)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    print("{:>8} {:>16} {:>16}".format("size", "concatenate", "LineBuffer"))
+    for megabytes in (1, 4, 16):
+        parts = chunks(synthetic_response(megabytes * 1024 * 1024))
+        assert split_concatenating(parts) == split_line_buffer(parts)
+        print(
+            "{:>6}MB {:>14.1f}ms {:>14.1f}ms".format(
+                megabytes,
+                measure(split_concatenating, parts) * 1000,
+                measure(split_line_buffer, parts) * 1000,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Cache of the (states, err) pairs returned by Lean, keyed by a hash of the
+checked text and of the lines whose states are asked.
+
+The storage is pluggable, the backend and its options are given by the
+LEAN_STATES_CACHE setting.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+
+def cache_key(text, lines) -> str:
+    digest = hashlib.sha256(text.encode("utf-8"))
+    digest.update(b"\0" + ",".join(str(line) for line in lines).encode())
+    return digest.hexdigest()
+
+
+class LocalLRUBackend:
+    """In-process least recently used cache."""
+
+    def __init__(self, max_size=1000, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+class DjangoCacheBackend:
+    """Cache stored through Django's cache framework, for example in a
+    FileBasedCache shared by all the processes. The size is bounded by the
+    MAX_ENTRIES option of that cache."""
+
+    def __init__(self, alias="default", ttl=None):
+        self.alias = alias
+        self.ttl = ttl
+
+    def get(self, key):
+        return caches[self.alias].get("lean_states:" + key)
+
+    def set(self, key, value):
+        caches[self.alias].set("lean_states:" + key, value, self.ttl)
+
+
+class StatesCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, text, lines) -> Optional[tuple]:
+        value = self.backend.get(cache_key(text, lines))
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, text, lines, states, err):
+        self.backend.set(cache_key(text, lines), (states, err))
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+def build_states_cache() -> StatesCache:
+    config = settings.LEAN_STATES_CACHE
+    backend = import_string(config["BACKEND"])(**config.get("OPTIONS", {}))
+    return StatesCache(backend)
@@ -1,50 +1,287 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
 from pathlib import Path
 
-import trio
-import os
+from asgiref.sync import sync_to_async
+from django.conf import settings
+import trio  # type: ignore
 
+from leanclient.cache import build_states_cache
 from leanclient.commands import Severity
-from leanclient.trio_server import TrioLeanServer
+from leanclient.exceptions import LeanBusyError, LeanTimeoutError
+from leanclient.pool import LeanServerPool
+from leanclient.prelude import ensure_prelude
+from leanclient.sessions import ProofSession, SessionStore
+from leanclient.timing import REGISTRY, span
 
 LEAN_DIR = "lean-project/"
 LEAN_DIR_SRC = LEAN_DIR + "src/"
 
+_pool = None
+_pool_lock = threading.Lock()
+_sessions = SessionStore(settings.LEAN_SESSIONS_MAX)
+_states_cache = build_states_cache()
 
-def chdir():
-    cur = os.getcwd()
-    os.chdir(LEAN_DIR)
-    return cur
 
+def get_pool():
+    """Pool of warm Lean servers shared by every request of this process."""
+    global _pool
+    if _pool is None:
+        # Only a freshness check when the prelude was built at deploy time,
+        # otherwise the build is guarded by a lock file shared by the processes
+        ensure_prelude(LEAN_DIR)
+    with _pool_lock:
+        if _pool is None:
+            _pool = LeanServerPool(
+                settings.LEAN_POOL_SIZE,
+                cwd=LEAN_DIR,
+                max_queue=settings.LEAN_QUEUE_MAX,
+                queue_timeout=settings.LEAN_QUEUE_TIMEOUT,
+                max_jobs=settings.LEAN_SERVER_MAX_JOBS,
+                max_age=settings.LEAN_SERVER_MAX_AGE,
+                max_rss=settings.LEAN_SERVER_MAX_RSS,
+            )
+    return _pool
 
-def get_error(messages):
-    for msg in messages:
-        if msg.severity == Severity.error:
-            return msg.text
+
+def start_pool():
+    get_pool().start()
+
+
+def get_error(messages, path=None):
+    for msg in messages.with_severity(Severity.error):
+        # A reused server also reports the messages of previously checked files
+        if path and Path(msg.file_name).name != Path(path).name:
+            continue
+        return msg.text
     return None
 
 
-async def states_lines_async(path, lines):
-    tot_lines = Path(path).read_text(encoding="utf-8").split("\n")
-    res = []
-    async with trio.open_nursery() as nursery:
-        server = TrioLeanServer(nursery)
-        await server.start()
-        with trio.move_on_after(10):
-            await server.full_sync(path)
+async def states_lines_async(
+    server,
+    path,
+    lines,
+    content=None,
+    known=None,
+    on_state=None,
+    timeout=None,
+    timings=None,
+):
+    """States after each of the given lines. The states of known that are not
+    None are reused instead of asking Lean. on_state is called with the index
+    of each line as soon as its state is known. timeout defaults to the
+    LEAN_SYNC_TIMEOUT setting and bounds both the check and the info requests,
+    the states not received in time are ''. The time of the check and of the
+    info requests is added to timings."""
+    if timeout is None:
+        timeout = settings.LEAN_SYNC_TIMEOUT
+    deadline = trio.current_time() + timeout
+    if content is None:
+        content = Path(LEAN_DIR + path).read_text(encoding="utf-8")
+    if known is None:
+        known = [None] * len(lines)
+    to_ask = [i for i in range(len(lines)) if known[i] is None]
+    if on_state:
         for i in range(len(lines)):
-            after = await server.state(path, lines[i], len(tot_lines[lines[i] - 1]))
-            res.append(after)
-        err = get_error(server.messages)
-        server.kill()
-        nursery.cancel_scope.cancel()
+            if known[i] is not None:
+                on_state(i, known[i])
+    tot_lines = content.split("\n")
+    with span(timings, "full_sync"):
+        await server.set_roi(path, 1, len(tot_lines))
+        finished = await server.full_sync(path, content, timeout)
+    pending = server.pending_tasks(path)
+    positions = [(lines[i], len(tot_lines[lines[i] - 1])) for i in to_ask]
+    res = list(known)
+
+    def on_asked_state(j, state):
+        res[to_ask[j]] = state
+        if on_state:
+            on_state(to_ask[j], state)
+
+    with span(timings, "info"):
+        with trio.move_on_at(deadline):
+            await server.states(path, positions, on_asked_state)
+    missing = [i for i in to_ask if res[i] is None]
+    for i in missing:
+        res[i] = ""
+        if on_state:
+            on_state(i, "")
+    err = get_error(server.messages, path)
+    if not finished or missing:
+        line = min((task.pos_line for task in pending), default=None)
+        raise LeanTimeoutError(res, err, line)
     return res, err
 
 
+async def states_text_async(
+    server, text, lines, known=None, on_state=None, timeout=None, timings=None
+):
+    # Every server only ever sees its own file, so nothing is shared between
+    # concurrent checks and the server doesn't keep old files open
+    path = "src/result_{}.lean".format(server.process.pid)
+    return await states_lines_async(
+        server, path, lines, text, known, on_state, timeout, timings
+    )
+
+
+async def states_texts_async(server, items, deadline=None):
+    """states_text_async for each (text, lines) item, one after the other on
+    the same server. The imports are only elaborated for the first one. The
+    result of an item is its (states, err) or the LeanTimeoutError it
+    raised. The items not checked by the deadline, a time.monotonic() value,
+    are given as timed out."""
+    results = []
+    for text, lines in items:
+        timeout = settings.LEAN_SYNC_TIMEOUT
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+        if timeout <= 0:
+            results.append(LeanTimeoutError([""] * len(lines), None, None))
+            continue
+        try:
+            results.append(
+                await states_text_async(server, text, lines, timeout=timeout)
+            )
+        except LeanTimeoutError as e:
+            results.append(e)
+    return results
+
+
 def states(path, lines):
-    old_dir = chdir()
+    """States after the given lines of a file of the Lean project."""
     path = "src/" + path
-    try:
-        res, err = trio.run(states_lines_async, path, lines)
-    finally:
-        os.chdir(old_dir)
-    return res, err
+    return get_pool().run(states_lines_async, path, lines)
+
+
+def submit_states_text(
+    text, lines, session=None, on_state=None, timings=None
+) -> Future:
+    """Schedule the check of a Lean text that is never written to disk and
+    return a future of the states after the given lines and of the error.
+    Identical checks are answered from the cache. With a session, the states
+    of the lines before the first change since the previous check of that
+    session are reused instead of being asked to Lean, the text is still
+    checked in full. Raises LeanBusyError if the Lean queue is full.
+    on_state is called, from any thread, with the index of each line as soon as
+    its state is known. The time of the Lean stages is added to timings."""
+    result: Future = Future()
+    cached = _states_cache.get(text, lines)
+    if cached is not None:
+        if on_state:
+            for i, state in enumerate(cached[0]):
+                on_state(i, state)
+        if session:
+            _sessions.set(session, ProofSession(text, lines, cached[0]))
+        result.set_result(cached)
+        return result
+    previous = _sessions.get(session) if session else None
+    known = previous.known_states(text, lines) if previous else None
+
+    def done(job):
+        try:
+            res, err = job.result()
+        except Exception as e:
+            result.set_exception(e)
+            return
+        _states_cache.set(text, lines, res, err)
+        if session:
+            _sessions.set(session, ProofSession(text, lines, res))
+        result.set_result((res, err))
+
+    job = get_pool().submit(
+        states_text_async, text, lines, known, on_state, None, timings, timings=timings
+    )
+    job.add_done_callback(done)
+    return result
+
+
+def states_text(text, lines, session=None, timings=None):
+    return submit_states_text(text, lines, session, timings=timings).result()
+
+
+def run_batch_chunk(pool, items, deadline, first):
+    """states_texts_async of a chunk of a batch as a pool job taking a slot of
+    the queue per item. When the queue is full, the first chunk is refused
+    like any check, the next ones wait for room until the deadline and their
+    items are then given as timed out."""
+    while True:
+        try:
+            return pool.run(states_texts_async, items, deadline, slots=len(items))
+        except LeanBusyError as e:
+            if first:
+                raise
+            if time.monotonic() + e.retry_after >= deadline:
+                return [
+                    LeanTimeoutError([""] * len(lines), None, None)
+                    for _, lines in items
+                ]
+            time.sleep(e.retry_after)
+
+
+def states_texts(items):
+    """states_text for many (text, lines) items, checked in Lean jobs of
+    LEAN_BATCH_CHUNK items so that other checks get a server in between. The
+    cached items are not asked again and identical items are checked once.
+    Returns for each item its (states, err) or a LeanTimeoutError, the items
+    not checked within LEAN_BATCH_TIMEOUT seconds are timed out. Raises
+    LeanBusyError if the Lean queue is full."""
+    results = [_states_cache.get(text, lines) for text, lines in items]
+    # Index of the first of the identical items for each item
+    first = {}
+    same = [
+        first.setdefault((text, tuple(lines)), i)
+        for i, (text, lines) in enumerate(items)
+    ]
+    to_check = [i for i in range(len(items)) if results[i] is None and same[i] == i]
+    pool = get_pool() if to_check else None
+    deadline = time.monotonic() + settings.LEAN_BATCH_TIMEOUT
+    size = settings.LEAN_BATCH_CHUNK
+    for k in range(0, len(to_check), size):
+        chunk = to_check[k : k + size]
+        checked = run_batch_chunk(pool, [items[i] for i in chunk], deadline, k == 0)
+        for i, res in zip(chunk, checked):
+            if not isinstance(res, LeanTimeoutError):
+                _states_cache.set(items[i][0], items[i][1], *res)
+            results[i] = res
+    return [results[i] for i in same]
+
+
+async def states_text_asyncio(text, lines, session=None, timings=None):
+    """states_text for asyncio code, the event loop is free while Lean works."""
+    # Starting the pool can take a while, keep it off the event loop
+    await sync_to_async(start_pool, thread_sensitive=False)()
+    return await asyncio.wrap_future(
+        submit_states_text(text, lines, session, timings=timings)
+    )
+
+
+def stream_states_text(text, lines, session=None):
+    """states_text giving the states as they come. Returns an iterator of
+    (index, state) pairs, and the future of the final (states, err)."""
+    updates = queue.Queue()
+    future = submit_states_text(
+        text, lines, session, lambda i, state: updates.put((i, state))
+    )
+    future.add_done_callback(lambda _: updates.put(None))
+
+    def iterate():
+        while True:
+            update = updates.get()
+            if update is None:
+                return
+            yield update
+
+    return iterate(), future
+
+
+def stats():
+    """Figures about the Lean checks of this process, for the metrics
+    endpoint."""
+    return {
+        "stages": REGISTRY.snapshot(),
+        "cache": _states_cache.stats(),
+        "pool": _pool.stats() if _pool is not None else None,
+    }
@@ -13,9 +13,10 @@ Everything else in this file are intermediate objects that will be contained in
 response objects.
 """
 from dataclasses import dataclass
-from typing import Optional, List, NewType, ClassVar
+from typing import Optional, List, NewType, ClassVar, Collection, Iterator, Sequence
 from enum import Enum
 import json
+import re
 
 @dataclass
 class Request:
@@ -36,7 +37,7 @@ class Response:
 
     @classmethod
     def from_dict(cls, dic):
-        if 'message' in dic and cls != ErrorResponse:
+        if 'message' in dic and 'message' not in cls.__dataclass_fields__:
             dic.pop('message') # This is a hack for "file invalidated" messages
         return cls(**dic)
 
@@ -58,14 +59,46 @@ class Message:
         dic['severity'] = getattr(Severity, dic['severity'])
         return cls(**dic)
 
+class LazyMessages(Sequence):
+    """List of messages built from their json dictionaries only when they are
+    accessed, most messages sent by Lean are never looked at."""
+
+    def __init__(self, dicts: List[dict]):
+        self.dicts = dicts
+        self.built: List[Optional[Message]] = [None] * len(dicts)
+
+    def __len__(self):
+        return len(self.dicts)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        msg = self.built[i]
+        if msg is None:
+            msg = self.built[i] = Message.from_dict(dict(self.dicts[i]))
+        return msg
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def with_severity(self, severity: Severity) -> Iterator[Message]:
+        """Messages of the given severity, the others are not built."""
+        for i, dic in enumerate(self.dicts):
+            if dic['severity'] == severity.name:
+                yield self[i]
+
+
 @dataclass
 class AllMessagesResponse(Response):
     response = 'all_messages'
-    msgs: List[Message]
+    msgs: Sequence[Message]
 
     @classmethod
     def from_dict(cls, dic):
-        return cls([Message.from_dict(msg) for msg in dic['msgs']])
+        return cls(LazyMessages(dic['msgs']))
 
 @dataclass
 class Task:
@@ -97,6 +130,13 @@ class CommandResponse(Response):
     seq_num: int
 
 
+@dataclass
+class SyncResponse(CommandResponse):
+    """Response to a sync, message is "file invalidated" or "file unchanged"
+    when the file already had this content, Lean then doesn't check it again."""
+    message: str
+
+
 @dataclass
 class ErrorResponse(Response):
     response = 'error'
@@ -371,29 +411,51 @@ class LongSleepRequest(Request):
     command = 'long_sleep'
 
 
-def parse_response(data: str) -> Response:
-    dic = json.loads(data)
-    response = dic.pop('response')
-    if response == 'ok':
-        if 'completions' in dic:
-            return CompleteResponse.from_dict(dic)
-        elif 'record' in dic:
-            return InfoResponse.from_dict(dic)
-        elif 'results' in dic and 'start' in dic:
-            return HoleCommandsResponse.from_dict(dic)
-        elif 'results' in dic:
-            return SearchResponse.from_dict(dic)
-        elif 'holes' in dic:
-            return AllHoleCommandsResponse.from_dict(dic)
-        elif 'replacements' in dic:
-            return HoleResponse.from_dict(dic)
-
-
-    # Now try classes for messages that do have a helpful response field
-    for cls in [AllMessagesResponse, CurrentTasksResponse, CommandResponse,
-            ErrorResponse]:
-        if response == cls.response: # type: ignore
-            return cls.from_dict(dic) # type: ignore
-    raise ValueError("Couldn't parse response string.")
+# Responses to commands all have the kind 'ok', their class is given by the
+# first of these keys they contain
+OK_RESPONSES = [
+    (('completions',), CompleteResponse),
+    (('record',), InfoResponse),
+    (('results', 'start'), HoleCommandsResponse),
+    (('results',), SearchResponse),
+    (('holes',), AllHoleCommandsResponse),
+    (('replacements',), HoleResponse),
+    (('message',), SyncResponse),
+]
+
+
+def parse_ok_response(dic) -> Response:
+    for keys, cls in OK_RESPONSES:
+        if all(key in dic for key in keys):
+            return cls.from_dict(dic)
+    return CommandResponse.from_dict(dic)
+
 
+RESPONSE_PARSERS = {
+    'ok': parse_ok_response,
+    'all_messages': AllMessagesResponse.from_dict,
+    'current_tasks': CurrentTasksResponse.from_dict,
+    'error': ErrorResponse.from_dict,
+}
 
+# Quotes inside json strings are escaped, so this only matches the key
+RESPONSE_KIND = re.compile(r'"response"\s*:\s*"(\w+)"')
+
+
+def response_kind(data: str) -> Optional[str]:
+    """Kind of a response, without decoding its json."""
+    match = RESPONSE_KIND.search(data)
+    return match.group(1) if match else None
+
+
+def parse_response(data: str, kinds: Optional[Collection[str]] = None) -> Optional[Response]:
+    """Build the response object of a json line. If kinds is given, the
+    responses of another kind are dropped without being decoded and None is
+    returned."""
+    if kinds is not None and response_kind(data) not in kinds:
+        return None
+    dic = json.loads(data)
+    parser = RESPONSE_PARSERS.get(dic.pop('response'))
+    if parser is None:
+        raise ValueError("Couldn't parse response string.")
+    return parser(dic)
@@ -0,0 +1,43 @@
+class LeanError(Exception):
+    pass
+
+
+class LeanTimeoutError(LeanError):
+    """Lean did not finish checking a file within its budget. The states and
+    error collected so far are kept, as well as the first line Lean was
+    still working on."""
+
+    def __init__(self, states, err, line):
+        super().__init__("Lean check timed out at line {}".format(line))
+        self.states = states
+        self.err = err
+        self.line = line
+
+
+class LeanBusyError(LeanError):
+    """Too many checks are already waiting for a Lean server. retry_after is
+    an estimation, in seconds, of when a new check could be accepted."""
+
+    def __init__(self, retry_after):
+        super().__init__("Lean servers are busy")
+        self.retry_after = retry_after
+
+
+class LeanUnavailableError(LeanBusyError):
+    """No Lean server could be checked out in time, for example because they
+    fail to start."""
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.args = ("No Lean server is available",)
+
+
+class LeanMessageTooLargeError(LeanError):
+    """Lean sent a message bigger than the accepted size."""
+
+    def __init__(self, size, max_size):
+        super().__init__(
+            "Lean message of more than {} bytes (maximum {})".format(size, max_size)
+        )
+        self.size = size
+        self.max_size = max_size
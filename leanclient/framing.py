@@ -0,0 +1,41 @@
+"""
+Splitting of the Lean server output into JSON lines.
+
+Lean sends one JSON message per line, and big messages (all_messages,
+current_tasks) are read in many chunks. The bytes are kept in a growable
+buffer and only the newly received bytes are scanned for newlines, so a
+message is copied and decoded once whatever the number of chunks.
+"""
+from typing import List
+
+from leanclient.exceptions import LeanMessageTooLargeError
+
+# Largest message accepted from Lean, in bytes
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+
+class LineBuffer:
+    def __init__(self, max_size: int = MAX_MESSAGE_SIZE):
+        self.max_size = max_size
+        self.buffer = bytearray()
+        # Bytes before this index are known not to contain a newline
+        self.scanned = 0
+
+    def feed(self, data: bytes) -> List[str]:
+        """Add received bytes, and return the complete lines decoded."""
+        self.buffer += data
+        lines = []
+        start = 0
+        end = self.buffer.find(b"\n", self.scanned)
+        while end != -1:
+            if end - start > self.max_size:
+                raise LeanMessageTooLargeError(end - start, self.max_size)
+            lines.append(self.buffer[start:end].decode())
+            start = end + 1
+            end = self.buffer.find(b"\n", start)
+        if start:
+            del self.buffer[:start]
+        self.scanned = len(self.buffer)
+        if self.scanned > self.max_size:
+            raise LeanMessageTooLargeError(self.scanned, self.max_size)
+        return lines
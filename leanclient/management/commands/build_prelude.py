@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from leanclient.client_wrapper import LEAN_DIR
+from leanclient.prelude import build_prelude, is_prelude_fresh, prelude_lock
+
+
+class Command(BaseCommand):
+    help = "Compile the MaProS prelude module of the Lean project"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force", action="store_true", help="Rebuild even if up to date"
+        )
+
+    def handle(self, *args, **options):
+        with prelude_lock(LEAN_DIR):
+            if not options["force"] and is_prelude_fresh(LEAN_DIR):
+                self.stdout.write("Prelude is up to date")
+                return
+            build_prelude(LEAN_DIR)
+        self.stdout.write(self.style.SUCCESS("Prelude compiled"))
@@ -0,0 +1,11 @@
+import data.real.basic
+notation `|` x `|` := abs x
+@[user_attribute]
+meta def ineq_rules : user_attribute :=
+{ name := `ineq_rules,
+  descr := "lemmas usable to prove inequalities" }
+attribute [ineq_rules] add_lt_add le_max_left le_max_right
+meta def obvious_ineq := `[linarith <|> apply_rules ineq_rules]
+run_cmd add_interactive [`obvious_ineq]
+definition is_limit (a : ℕ → ℝ) (l : ℝ) :=
+∀ ε > 0, ∃ N, ∀ n ≥ N, | a n - l | < ε
@@ -0,0 +1,297 @@
+"""
+Pool of long-lived Lean servers.
+
+Starting `lean --server` and elaborating the imports takes most of the time of
+a proof check, so the servers are started once and reused between requests.
+They live in a trio event loop running in a background thread, jobs can be
+submitted from any thread and are run on a checked out server.
+
+At most `size` jobs run at once, the others wait for a server. When more than
+`max_queue` jobs are waiting, new jobs are refused instead of piling up.
+
+The memory of a Lean server grows with every file it has seen, so a server is
+retired between two jobs once it has run `max_jobs` jobs, lived `max_age`
+seconds or uses more than `max_rss` bytes, and a new one takes its place.
+A server that can't be started again is retried with a growing delay, and a
+job that doesn't get a server within `queue_timeout` seconds fails with
+LeanUnavailableError.
+
+close() stops the servers and the event loop, a job submitted afterwards
+starts them again.
+"""
+import logging
+import math
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional, Union
+
+import trio  # type: ignore
+
+from leanclient.exceptions import LeanBusyError, LeanUnavailableError
+from leanclient.timing import REGISTRY
+from leanclient.trio_server import TrioLeanServer
+
+logger = logging.getLogger(__name__)
+
+# Seconds before starting again a Lean server that failed to start, doubled
+# after each failure
+SPAWN_RETRY_DELAY = 1
+SPAWN_RETRY_MAX_DELAY = 60
+
+
+class LeanServerPool:
+    def __init__(
+        self,
+        size: int = 1,
+        lean_cmd: Union[str, List[str]] = "lean",
+        cwd: Optional[str] = None,
+        max_queue: Optional[int] = None,
+        max_jobs: Optional[int] = None,
+        max_age: Optional[float] = None,
+        max_rss: Optional[int] = None,
+        queue_timeout: Optional[float] = None,
+    ):
+        self.size = size
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.max_jobs = max_jobs
+        self.max_age = max_age
+        self.max_rss = max_rss
+        self.retired = 0
+        self.waiting = 0
+        # Moving average of the duration of a job, used for retry hints
+        self.job_duration = 1.0
+        self.lean_cmd = lean_cmd
+        self.cwd = cwd
+        self.thread: Optional[threading.Thread] = None
+        self.trio_token = None
+        self.nursery = None
+        self.idle_send = None
+        self.idle_receive = None
+        # Servers started and not replaced yet, idle or running a job
+        self.servers = set()
+        self.started = threading.Event()
+        self.start_error: Optional[BaseException] = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Start the event loop thread and wait for the servers to be ready.
+        The event loop is started again if it ended, for example because the
+        servers failed to start."""
+        with self.lock:
+            ended = self.started.is_set() and not self.thread.is_alive()
+            if self.thread is None or ended:
+                self.started = threading.Event()
+                self.start_error = None
+                self.servers = set()
+                self.thread = threading.Thread(
+                    target=trio.run, args=(self._main,), daemon=True
+                )
+                self.thread.start()
+            started = self.started
+        started.wait()
+        if self.start_error:
+            raise self.start_error
+
+    def close(self):
+        """Stop the Lean servers and the event loop thread. The jobs not done
+        yet fail with LeanUnavailableError."""
+        with self.lock:
+            thread = self.thread
+        if thread is None:
+            return
+        self.started.wait()
+        try:
+            trio.from_thread.run(self._close, trio_token=self.trio_token)
+        except trio.RunFinishedError:
+            pass
+        thread.join()
+
+    async def _close(self):
+        # The jobs are cancelled before their server goes away, and the
+        # event loop ends once the servers have exited
+        self.nursery.cancel_scope.cancel()
+        with trio.CancelScope(shield=True):
+            for server in list(self.servers):
+                if server.is_alive():
+                    server.kill()
+                await server.process.wait()
+
+    async def _main(self):
+        self.trio_token = trio.lowlevel.current_trio_token()
+        self.idle_send, self.idle_receive = trio.open_memory_channel(self.size)
+        async with trio.open_nursery() as nursery:
+            self.nursery = nursery
+            try:
+                for _ in range(self.size):
+                    await self.idle_send.send(await self._spawn())
+            except Exception as e:
+                self.start_error = e
+                nursery.cancel_scope.cancel()
+                return
+            finally:
+                self.started.set()
+            await trio.sleep_forever()
+
+    async def _spawn(self) -> TrioLeanServer:
+        start = time.perf_counter()
+        server = await self.nursery.start(self._run_server)
+        self.servers.add(server)
+        REGISTRY.observe("lean_start", time.perf_counter() - start)
+        return server
+
+    async def _run_server(self, task_status=trio.TASK_STATUS_IGNORED):
+        """Run a Lean server until its process exits."""
+        started = False
+        try:
+            async with trio.open_nursery() as nursery:
+                # The current tasks are only decoded during full_sync
+                server = TrioLeanServer(
+                    nursery, self.lean_cmd, cwd=self.cwd, subscriptions=["all_messages"]
+                )
+                await server.start()
+                task_status.started(server)
+                started = True
+        except Exception:
+            # A server crashing must not take the whole pool down, it is
+            # replaced when it is checked back in.
+            if not started:
+                raise
+
+    async def _replace(self, server: TrioLeanServer):
+        self.servers.discard(server)
+        try:
+            if server.process and server.is_alive():
+                await server.stop()
+        except Exception:
+            logger.exception("Failed to stop a Lean server")
+        delay = SPAWN_RETRY_DELAY
+        while True:
+            try:
+                new_server = await self._spawn()
+            except Exception:
+                logger.exception(
+                    "Failed to start a Lean server, retrying in %s seconds", delay
+                )
+                await trio.sleep(delay)
+                delay = min(2 * delay, SPAWN_RETRY_MAX_DELAY)
+            else:
+                await self.idle_send.send(new_server)
+                return
+
+    def _should_retire(self, server: TrioLeanServer) -> bool:
+        if self.max_jobs is not None and server.jobs >= self.max_jobs:
+            return True
+        if self.max_age is not None and server.age() >= self.max_age:
+            return True
+        if self.max_rss is not None:
+            rss = server.rss()
+            if rss is not None and rss >= self.max_rss:
+                return True
+        return False
+
+    async def _check_in(self, server: TrioLeanServer):
+        try:
+            retire = self._should_retire(server)
+        except Exception:
+            logger.exception("Failed to check a Lean server, replacing it")
+            retire = True
+        if not server.is_alive():
+            self.nursery.start_soon(self._replace, server)
+        elif retire:
+            self.retired += 1
+            self.nursery.start_soon(self._replace, server)
+        else:
+            await self.idle_send.send(server)
+
+    async def _run_job(self, future: Future, job, args, timings=None, slots=1):
+        try:
+            await self._run_checked_out(future, job, args, timings, slots)
+        finally:
+            # Cancelled, or no server came in time
+            if not future.done():
+                future.set_exception(LeanUnavailableError(self.retry_after()))
+
+    async def _run_checked_out(self, future: Future, job, args, timings=None, slots=1):
+        submitted = time.perf_counter()
+        server = None
+        try:
+            if not future.set_running_or_notify_cancel():
+                return
+            timeout = self.queue_timeout
+            with trio.move_on_after(timeout if timeout is not None else math.inf):
+                server = await self.idle_receive.receive()
+        finally:
+            with self.lock:
+                self.waiting -= slots
+        if server is None:
+            return
+        if timings is not None:
+            timings.add("queue", time.perf_counter() - submitted)
+        start = time.monotonic()
+        try:
+            result = await job(server, *args)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        finally:
+            server.jobs += 1
+            self.job_duration = 0.8 * self.job_duration + 0.2 * (
+                time.monotonic() - start
+            )
+            await self._check_in(server)
+
+    def retry_after(self) -> int:
+        """Seconds after which the waiting jobs should have been served."""
+        return max(1, math.ceil(self.job_duration * (self.waiting + 1) / self.size))
+
+    def submit(self, job, *args, timings=None, slots=1) -> Future:
+        """Schedule `await job(server, *args)` on a checked out server. Raises
+        LeanBusyError if too many jobs are already waiting, a job checking
+        several proofs takes that many slots of the queue. The future fails
+        with LeanUnavailableError if no server is free within queue_timeout
+        seconds. The time spent waiting for a server is added to timings as
+        the "queue" stage."""
+        future: Future = Future()
+        if self.max_queue is not None:
+            # Even a big job can get in once the queue is empty
+            slots = min(slots, self.max_queue)
+        # The event loop may end between start and scheduling, then it is
+        # started again once
+        for attempt in range(2):
+            self.start()
+            with self.lock:
+                if self.max_queue is not None and self.waiting + slots > self.max_queue:
+                    raise LeanBusyError(self.retry_after())
+                self.waiting += slots
+            try:
+                self.trio_token.run_sync_soon(
+                    self.nursery.start_soon,
+                    self._run_job,
+                    future,
+                    job,
+                    args,
+                    timings,
+                    slots,
+                )
+                return future
+            except trio.RunFinishedError:
+                with self.lock:
+                    self.waiting -= slots
+        raise LeanUnavailableError(self.retry_after())
+
+    def run(self, job, *args, timings=None, slots=1):
+        """Run `await job(server, *args)` on a checked out server and wait for
+        its result."""
+        return self.submit(job, *args, timings=timings, slots=slots).result()
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "servers": sum(server.is_alive() for server in list(self.servers)),
+            "waiting": self.waiting,
+            "retired": self.retired,
+            "job_duration": self.job_duration,
+        }
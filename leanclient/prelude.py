@@ -0,0 +1,68 @@
+"""
+The MaProS prelude is the Lean module defining the notations, tactics and
+definitions used by generated proofs. It is compiled once to an .olean inside
+the Lean project so that generated files only need to import it.
+
+It is compiled at deploy time by the build_prelude command. Otherwise the
+first process needing it compiles it, holding a lock file so that the other
+processes wait for it instead of compiling it at the same time.
+"""
+import shutil
+import subprocess
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+PRELUDE_MODULE = "mapros_prelude"
+PRELUDE_SOURCE = Path(__file__).with_name(PRELUDE_MODULE + ".lean")
+
+
+def prelude_paths(lean_dir):
+    src = Path(lean_dir) / "src"
+    return src / (PRELUDE_MODULE + ".lean"), src / (PRELUDE_MODULE + ".olean")
+
+
+@contextmanager
+def prelude_lock(lean_dir):
+    """Hold the lock on the build of the prelude of the Lean project."""
+    lock_path = Path(lean_dir) / "src" / (PRELUDE_MODULE + ".lock")
+    with open(lock_path, "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def is_prelude_fresh(lean_dir) -> bool:
+    """Whether the compiled prelude of the Lean project matches the source."""
+    lean_file, olean_file = prelude_paths(lean_dir)
+    if not lean_file.exists() or not olean_file.exists():
+        return False
+    if lean_file.read_bytes() != PRELUDE_SOURCE.read_bytes():
+        return False
+    return olean_file.stat().st_mtime >= lean_file.stat().st_mtime
+
+
+def build_prelude(lean_dir, lean_cmd: Union[str, List[str]] = "lean"):
+    """Copy the prelude in the Lean project and compile it."""
+    lean_cmd = lean_cmd if isinstance(lean_cmd, list) else [lean_cmd]
+    lean_file, _ = prelude_paths(lean_dir)
+    shutil.copyfile(PRELUDE_SOURCE, lean_file)
+    subprocess.run(
+        lean_cmd + ["--make", str(lean_file.relative_to(lean_dir))],
+        cwd=lean_dir,
+        check=True,
+    )
+
+
+def ensure_prelude(lean_dir, lean_cmd: Union[str, List[str]] = "lean"):
+    if is_prelude_fresh(lean_dir):
+        return
+    with prelude_lock(lean_dir):
+        # Another process may have built it while we waited
+        if not is_prelude_fresh(lean_dir):
+            build_prelude(lean_dir, lean_cmd)
@@ -0,0 +1,63 @@
+"""
+Memory of the last check of each proof session, so that a proof that is being
+edited only gets the states of its changed lines asked to Lean again.
+
+The state after a line only depends on the text up to that line, so every
+state of a line before the first edited one can be reused.
+
+Only the info requests of those lines are saved: the next check of a session
+may run on any server of the pool, the whole text is synced again and Lean 3
+elaborates the whole theorem again.
+"""
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+
+def first_changed_line(old_text: str, new_text: str) -> int:
+    """Number (starting at 1) of the first line that differs between the two
+    texts."""
+    old_lines = old_text.split("\n")
+    new_lines = new_text.split("\n")
+    for i, (old, new) in enumerate(zip(old_lines, new_lines)):
+        if old != new:
+            return i + 1
+    return min(len(old_lines), len(new_lines)) + 1
+
+
+class ProofSession:
+    def __init__(self, text: str, lines: List[int], states: List[str]):
+        self.text = text
+        self.states_by_line = dict(zip(lines, states))
+
+    def known_states(self, text: str, lines: List[int]) -> List[Optional[str]]:
+        """States that are still valid for the new text, None for those that
+        must be asked again."""
+        changed = first_changed_line(self.text, text)
+        return [
+            self.states_by_line.get(line) if line < changed else None
+            for line in lines
+        ]
+
+
+class SessionStore:
+    """Bounded store of the most recently used sessions."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.sessions: "OrderedDict[str, ProofSession]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[ProofSession]:
+        with self.lock:
+            session = self.sessions.get(key)
+            if session:
+                self.sessions.move_to_end(key)
+            return session
+
+    def set(self, key: str, session: ProofSession):
+        with self.lock:
+            self.sessions[key] = session
+            self.sessions.move_to_end(key)
+            while len(self.sessions) > self.max_size:
+                self.sessions.popitem(last=False)
@@ -1,10 +1,37 @@
 from django.test import TestCase
 
 # from https://github.com/leanprover-community/lean-client-python
+import json
+import sys
+import tempfile
+import threading
+import time
 from pathlib import Path
 
 import trio  # type: ignore
 
+from leanclient.cache import DjangoCacheBackend, LocalLRUBackend, StatesCache
+from leanclient import client_wrapper
+from leanclient.client_wrapper import get_error, states_text_async, states_texts_async
+from leanclient.commands import (
+    AllMessagesResponse,
+    CommandResponse,
+    InfoResponse,
+    Severity,
+    SyncResponse,
+    parse_response,
+)
+from leanclient.exceptions import (
+    LeanBusyError,
+    LeanMessageTooLargeError,
+    LeanTimeoutError,
+    LeanUnavailableError,
+)
+from leanclient.framing import LineBuffer
+from leanclient.pool import LeanServerPool
+from leanclient.prelude import ensure_prelude, is_prelude_fresh
+from leanclient.sessions import ProofSession, first_changed_line
+from leanclient.timing import Registry, Timings
 from leanclient.trio_server import TrioLeanServer
 
 
@@ -31,3 +58,325 @@ async def main():
 class ExampleTest(TestCase):
     def test_basic(self):
         trio.run(main)
+
+
+class ProofSessionTest(TestCase):
+    def test_known_states(self):
+        text = "import a\ntheorem t\nbegin\nx,\ny,\nend"
+        session = ProofSession(text, [3, 4, 5], ["s3", "s4", "s5"])
+        edited = "import a\ntheorem t\nbegin\nx,\nz,\nw,\nend"
+        self.assertEqual(session.known_states(edited, [3, 4, 5, 6]), ["s3", "s4", None, None])
+        self.assertEqual(session.known_states(text, [3, 4, 5]), ["s3", "s4", "s5"])
+
+    def test_first_changed_line(self):
+        self.assertEqual(first_changed_line("a\nb", "a\nc"), 2)
+        self.assertEqual(first_changed_line("a\nb", "a\nb\nc"), 3)
+
+
+class StatesCacheTest(TestCase):
+    def test_hit_miss(self):
+        cache = StatesCache(LocalLRUBackend(max_size=2))
+        self.assertIsNone(cache.get("text", [1, 2]))
+        cache.set("text", [1, 2], ["a", "b"], None)
+        self.assertEqual(cache.get("text", [1, 2]), (["a", "b"], None))
+        self.assertIsNone(cache.get("text", [1]))
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 2})
+
+    def test_lru_eviction(self):
+        backend = LocalLRUBackend(max_size=2)
+        backend.set("a", 1)
+        backend.set("b", 2)
+        backend.get("a")
+        backend.set("c", 3)
+        self.assertEqual(backend.get("a"), 1)
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.get("c"), 3)
+
+    def test_ttl(self):
+        backend = LocalLRUBackend(ttl=-1)
+        backend.set("a", 1)
+        self.assertIsNone(backend.get("a"))
+
+    def test_django_backend(self):
+        cache = StatesCache(DjangoCacheBackend())
+        cache.set("text", [1], ["a"], "error")
+        self.assertEqual(cache.get("text", [1]), (["a"], "error"))
+
+
+class LineBufferTest(TestCase):
+    def test_split_chunks(self):
+        buffer = LineBuffer()
+        self.assertEqual(buffer.feed(b'{"a":'), [])
+        self.assertEqual(buffer.feed(b' 1}\n{"b": 2}\n{"c"'), ['{"a": 1}', '{"b": 2}'])
+        self.assertEqual(buffer.feed(b": 3}\n"), ['{"c": 3}'])
+        self.assertEqual(buffer.feed(b""), [])
+
+    def test_split_multibyte_character(self):
+        data = "⊢ goal\n".encode()
+        buffer = LineBuffer()
+        self.assertEqual(buffer.feed(data[:1]), [])
+        self.assertEqual(buffer.feed(data[1:]), ["⊢ goal"])
+
+    def test_max_size(self):
+        buffer = LineBuffer(max_size=4)
+        self.assertEqual(buffer.feed(b"1234\n"), ["1234"])
+        with self.assertRaises(LeanMessageTooLargeError):
+            buffer.feed(b"12345")
+        with self.assertRaises(LeanMessageTooLargeError):
+            LineBuffer(max_size=4).feed(b"12345\n")
+
+
+class ParseResponseTest(TestCase):
+    def test_dispatch(self):
+        resp = parse_response('{"response": "ok", "seq_num": 1}')
+        self.assertEqual(resp, CommandResponse(seq_num=1))
+        resp = parse_response('{"record": {"state": "s"}, "response": "ok", "seq_num": 2}')
+        self.assertIsInstance(resp, InfoResponse)
+        self.assertEqual(resp.record.state, "s")
+        resp = parse_response(
+            '{"message": "file unchanged", "response": "ok", "seq_num": 3}'
+        )
+        self.assertEqual(resp, SyncResponse(seq_num=3, message="file unchanged"))
+        with self.assertRaises(ValueError):
+            parse_response('{"response": "unknown"}')
+
+    def test_subscriptions(self):
+        data = '{"is_running": true, "response": "current_tasks", "tasks": []}'
+        self.assertIsNone(parse_response(data, {"ok", "all_messages"}))
+        self.assertIsNotNone(parse_response(data, {"current_tasks"}))
+        # A quoted key inside a message text is not the kind of the response
+        data = '{"msgs": [], "response": "all_messages", "text": "\\"response\\": \\"ok\\""}'
+        self.assertIsNotNone(parse_response(data, {"all_messages"}))
+        self.assertIsNone(parse_response(data, {"ok"}))
+
+    def test_lazy_messages(self):
+        msg = {"file_name": "a.lean", "pos_line": 1, "pos_col": 0, "caption": "", "text": "t"}
+        resp = parse_response(json.dumps({
+            "response": "all_messages",
+            "msgs": [dict(msg, severity="information"), dict(msg, severity="error")],
+        }))
+        self.assertIsInstance(resp, AllMessagesResponse)
+        self.assertEqual(len(resp.msgs), 2)
+        errors = list(resp.msgs.with_severity(Severity.error))
+        self.assertEqual([m.severity for m in errors], [Severity.error])
+        self.assertEqual(resp.msgs.built, [None, errors[0]])
+        self.assertEqual(resp.msgs[0].severity, Severity.information)
+
+
+class TimingsTest(TestCase):
+    def test_stages(self):
+        timings = Timings()
+        timings.add("parse", 0.002)
+        timings.add("parse", 0.003)
+        with timings.span("info"):
+            pass
+        self.assertAlmostEqual(timings.stages["parse"], 0.005)
+        self.assertIn("info", timings.as_milliseconds())
+        registry = Registry()
+        timings.record(registry)
+        timings.record(registry)
+        parse = registry.snapshot()["parse"]
+        self.assertEqual(parse["count"], 2)
+        self.assertAlmostEqual(parse["sum"], 0.01)
+        self.assertEqual(parse["buckets"]["0.001"], 0)
+        self.assertEqual(parse["buckets"]["0.005"], 2)
+        self.assertEqual(parse["buckets"]["+Inf"], 2)
+
+
+FAKE_LEAN = [
+    sys.executable,
+    str(Path(__file__).resolve().parent.parent / "benchmarks" / "fake_lean.py"),
+]
+
+
+async def server_pid(server):
+    return server.process.pid
+
+
+async def stored_responses(server):
+    return len(server.responses)
+
+
+async def sleep_job(server, seconds):
+    await trio.sleep(seconds)
+
+
+async def kill_server(server):
+    server.kill()
+    await server.process.wait()
+
+
+async def sync_after_late_messages():
+    async with trio.open_nursery() as nursery:
+        server = TrioLeanServer(
+            nursery,
+            FAKE_LEAN
+            + ["--late-error", "late", "--start-latency", "0.1", "--line-latency", "0.2"],
+        )
+        await server.start()
+        start = trio.current_time()
+        await server.full_sync("src/a.lean", "a\nb")
+        elapsed = trio.current_time() - start
+        err = get_error(server.messages, "src/a.lean")
+        server.kill()
+        nursery.cancel_scope.cancel()
+    return elapsed, err
+
+
+class FakeLeanPoolTest(TestCase):
+    def setUp(self):
+        self.pools = []
+
+    def tearDown(self):
+        for pool in self.pools:
+            pool.close()
+
+    def make_pool(self, *args, **kwargs):
+        pool = LeanServerPool(*args, **kwargs)
+        self.pools.append(pool)
+        return pool
+
+    def test_states(self):
+        pool = self.make_pool(1, FAKE_LEAN + ["--state", "⊢ true"])
+        states, err = pool.run(states_text_async, "a\nb\nc", [2, 3])
+        self.assertEqual(states, ["⊢ true", "⊢ true"])
+        self.assertIsNone(err)
+        self.assertEqual(pool.run(server_pid), pool.run(server_pid))
+
+    def test_unchanged(self):
+        pool = self.make_pool(1, FAKE_LEAN + ["--unchanged", "--error", "e"])
+        first = pool.run(states_text_async, "a\nb", [2], None, None, 2)
+        start = time.monotonic()
+        # Lean doesn't check again a file that has this content
+        second = pool.run(states_text_async, "a\nb", [2], None, None, 2)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(second[1], "e")
+
+    def test_unchanged_after_timeout(self):
+        pool = self.make_pool(1, FAKE_LEAN + ["--unchanged", "--line-latency", "0.2"])
+        with self.assertRaises(LeanTimeoutError):
+            pool.run(states_text_async, "a\nb", [2], None, None, 0.1)
+        states, err = pool.run(states_text_async, "a\nb", [2], None, None, 5)
+        self.assertEqual(states, ["⊢ is_limit b l"])
+
+    def test_error(self):
+        pool = self.make_pool(1, FAKE_LEAN + ["--error", "unknown identifier"])
+        _, err = pool.run(states_text_async, "a\nb", [2])
+        self.assertEqual(err, "unknown identifier")
+
+    def test_timeout(self):
+        pool = self.make_pool(1, FAKE_LEAN + ["--line-latency", "1"])
+        with self.assertRaises(LeanTimeoutError) as cm:
+            pool.run(states_text_async, "a\nb", [2], None, None, 0.1)
+        self.assertEqual(cm.exception.line, 1)
+
+    def test_info_timeout(self):
+        pool = self.make_pool(1, FAKE_LEAN + ["--info-latency", "0.3"])
+        start = time.monotonic()
+        with self.assertRaises(LeanTimeoutError) as cm:
+            pool.run(states_text_async, "a\nb\nc", [1, 2, 3], None, None, 0.5)
+        # The info requests share the budget of the check
+        self.assertLess(time.monotonic() - start, 0.8)
+        self.assertEqual(cm.exception.states, ["⊢ is_limit b l", "", ""])
+        # Nothing is left behind on the server
+        self.assertEqual(pool.run(stored_responses), 0)
+
+    def test_late_messages(self):
+        elapsed, err = trio.run(sync_after_late_messages)
+        # The messages of a previous check don't end this one
+        self.assertGreaterEqual(elapsed, 0.5)
+        self.assertIsNone(err)
+
+    def test_batch_deadline(self):
+        pool = self.make_pool(1, FAKE_LEAN + ["--line-latency", "0.2"])
+        items = [("a\nb", [2]), ("a\nb", [2])]
+        start = time.monotonic()
+        results = pool.run(states_texts_async, items, start + 0.3)
+        self.assertLess(time.monotonic() - start, 0.6)
+        for res in results:
+            self.assertIsInstance(res, LeanTimeoutError)
+        self.assertEqual(results[1].states, [""])
+
+    def test_batch_duplicates(self):
+        pool = self.make_pool(1, FAKE_LEAN + ["--line-latency", "0.3"])
+        self.addCleanup(setattr, client_wrapper, "_pool", client_wrapper._pool)
+        client_wrapper._pool = pool
+        text = "duplicates\nb"
+        start = time.monotonic()
+        results = client_wrapper.states_texts([(text, [2]), (text, [2])])
+        # Checked once
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(results[0], (["⊢ is_limit b l"], None))
+        self.assertEqual(results[1], results[0])
+
+    def test_queue_slots(self):
+        pool = self.make_pool(1, FAKE_LEAN, max_queue=3)
+        running = pool.submit(sleep_job, 0.3)
+        while pool.waiting:
+            time.sleep(0.01)
+        batch = pool.submit(sleep_job, 0, slots=2)
+        with self.assertRaises(LeanBusyError):
+            pool.submit(sleep_job, 0, slots=2)
+        single = pool.submit(sleep_job, 0)
+        for future in [running, batch, single]:
+            future.result()
+        self.assertEqual(pool.waiting, 0)
+
+    def test_close(self):
+        pool = self.make_pool(1, FAKE_LEAN + ["--line-latency", "1"])
+        future = pool.submit(states_text_async, "a\nb", [2])
+        pool.close()
+        self.assertFalse(pool.thread.is_alive())
+        with self.assertRaises(LeanUnavailableError):
+            future.result()
+        self.assertEqual(pool.stats()["servers"], 0)
+
+    def test_recycle(self):
+        pool = self.make_pool(1, FAKE_LEAN, max_jobs=1)
+        self.assertNotEqual(pool.run(server_pid), pool.run(server_pid))
+        # A server is retired after its result is given
+        deadline = time.monotonic() + 5
+        while pool.retired < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(pool.retired, 2)
+
+    def test_respawn(self):
+        pool = self.make_pool(1, list(FAKE_LEAN), queue_timeout=0.2)
+        pool.run(server_pid)
+        # The server can't be started again for now
+        pool.lean_cmd = ["/nonexistent/lean"]
+        with self.assertLogs("leanclient.pool", "ERROR"):
+            pool.run(kill_server)
+            with self.assertRaises(LeanUnavailableError):
+                pool.run(server_pid)
+        self.assertEqual(pool.stats()["servers"], 0)
+        pool.lean_cmd = FAKE_LEAN
+        pool.queue_timeout = 10
+        pool.run(server_pid)
+        self.assertEqual(pool.stats()["servers"], 1)
+
+
+# Fake `lean --make src/mapros_prelude.lean` counting its runs
+FAKE_LEAN_MAKE = [
+    sys.executable,
+    "-c",
+    "import sys, time; time.sleep(0.2); open('builds', 'a').write('.');"
+    " open(sys.argv[2][:-5] + '.olean', 'w').close()",
+]
+
+
+class PreludeTest(TestCase):
+    def test_single_build(self):
+        with tempfile.TemporaryDirectory() as lean_dir:
+            Path(lean_dir, "src").mkdir()
+            threads = [
+                threading.Thread(target=ensure_prelude, args=(lean_dir, FAKE_LEAN_MAKE))
+                for _ in range(3)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertTrue(is_prelude_fresh(lean_dir))
+            self.assertEqual(Path(lean_dir, "builds").read_text(), ".")
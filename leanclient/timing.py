@@ -0,0 +1,103 @@
+"""
+Timing of the stages of a proof check.
+
+Each check gets a Timings adding up the time spent in each of its stages.
+Once the check is over, the totals are added to the histograms of the stages,
+shared by the whole process and exposed by the metrics endpoint.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+# Upper bounds, in seconds, of the histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, math.inf)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        """Cumulative count of the values under each bound."""
+        buckets = {}
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            buckets["+Inf" if bound == math.inf else str(bound)] = total
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+class Registry:
+    def __init__(self):
+        self.histograms: Dict[str, Histogram] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, stage: str, value: float):
+        with self.lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram()
+            self.histograms[stage].observe(value)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                stage: histogram.snapshot()
+                for stage, histogram in sorted(self.histograms.items())
+            }
+
+
+REGISTRY = Registry()
+
+
+class Timings:
+    """Seconds spent in each stage of a single check."""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self.lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def span(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def record(self, registry=REGISTRY):
+        """Add the totals of the stages to their histograms."""
+        with self.lock:
+            stages = dict(self.stages)
+        for stage, seconds in stages.items():
+            registry.observe(stage, seconds)
+
+    def as_milliseconds(self):
+        with self.lock:
+            return {stage: seconds * 1000 for stage, seconds in self.stages.items()}
+
+
+@contextmanager
+def span(timings, stage: str):
+    """Timings.span, doing nothing when there is no Timings."""
+    if timings is None:
+        yield
+    else:
+        with timings.span(stage):
+            yield
@@ -6,28 +6,46 @@ Communicating with the Lean server in a trio context
 This is only the beginning, implementing reading a file and requesting tactic
 state. See the example use in examples/trio_example.py.
 """
-from typing import Optional, List, Dict, Awaitable, Union
+from typing import Optional, List, Dict, Awaitable, Union, Tuple, Callable, Collection
 from subprocess import PIPE
+import math
+import time
 from pathlib import Path
 
 import trio # type: ignore
 
 from leanclient.commands import (parse_response, SyncRequest, InfoRequest,
-        Request, CommandResponse, Message, Task, Response,
-        InfoResponse, AllMessagesResponse, Severity, CurrentTasksResponse)
+        Request, CommandResponse, Message, Task, Response, SyncResponse,
+        InfoResponse, AllMessagesResponse, Severity, CurrentTasksResponse,
+        RoiRequest, FileRoi, RoiRange, CheckingMode, LazyMessages, RESPONSE_PARSERS)
+from leanclient.exceptions import LeanMessageTooLargeError
+from leanclient.framing import LineBuffer, MAX_MESSAGE_SIZE
 
 
 class TrioLeanServer:
-    def __init__(self, nursery, lean_cmd: Union[str, List[str]] = 'lean', debug=False, debug_bytes=False):
+    def __init__(self, nursery, lean_cmd: Union[str, List[str]] = 'lean', debug=False, debug_bytes=False,
+                 cwd: Optional[str] = None, max_message_size: int = MAX_MESSAGE_SIZE,
+                 subscriptions: Optional[Collection[str]] = None):
         """
         Lean server trio interface.
+
+        subscriptions are the kinds of responses that are decoded, by default
+        all of them. The responses to requests are always decoded, the others
+        are dropped unread.
         """
         self.nursery = nursery
         self.seq_num: int = 0
         self.lean_cmd: List[str] = lean_cmd if isinstance(lean_cmd, List) else [lean_cmd]
-        self.messages: List[Message] = []
+        self.cwd: Optional[str] = cwd
+        self.max_message_size: int = max_message_size
+        self.subscriptions = {'ok', 'error'} | set(
+                RESPONSE_PARSERS if subscriptions is None else subscriptions)
+        self.messages: LazyMessages = LazyMessages([])
         self.current_tasks: List[Task] = []
         self.process: Optional[trio.Process] = None
+        self.started_at: Optional[float] = None
+        # Number of jobs run on this server, counted by its user
+        self.jobs: int = 0
         self.debug: bool = debug
         self.debug_bytes: bool = debug_bytes
         # Each request, with sequence number seq_num, gets an event
@@ -37,66 +55,225 @@ class TrioLeanServer:
         # handled
         self.responses: Dict[int, Response] = dict()
         self.is_fully_ready: trio.Event = trio.Event()
+        # Sequence number of the sync in progress. The messages and tasks that
+        # come before its response may be late ones of a previous check of the
+        # same file, they are ignored.
+        self.sync_seq_num: Optional[int] = None
+        # Content of each file whose last check went to the end, Lean doesn't
+        # check again a file synced with the content it has
+        self.checked: Dict[str, Optional[str]] = dict()
+        # Set, and then replaced, each time Lean reports its current tasks
+        self.tasks_changed: trio.Event = trio.Event()
 
     async def start(self):
         self.process = await trio.open_process(
-                self.lean_cmd + ["--server"], stdin=PIPE, stdout=PIPE)
+                self.lean_cmd + ["--server"], stdin=PIPE, stdout=PIPE, cwd=self.cwd)
+        self.started_at = time.monotonic()
         self.nursery.start_soon(self.receiver)
 
     async def send(self, request: Request) -> Response:
+        responses = await self.send_many([request])
+        return responses[0]
+
+    async def send_many(self, requests: List[Request],
+                        on_response: Optional[Callable[[int, Response], None]] = None
+                        ) -> List[Response]:
+        """Send all requests at once, then wait for their responses and return
+        them in the same order. on_response is called with the index of each
+        request as soon as its response arrives."""
         if not self.process:
             raise ValueError('No Lean server')
-        self.seq_num += 1
-        request.seq_num = self.seq_num
-        self.response_events[self.seq_num] = trio.Event()
-        if self.debug:
-            print(f'Sending {request}')
-        if self.debug_bytes:
-            bytes = (request.to_json() + '\n').encode()
-            print(f'Sending {bytes!r}')
-        await self.process.stdin.send_all((request.to_json()+'\n').encode())
-        await self.response_events[request.seq_num].wait()
-        self.response_events.pop(request.seq_num)
-        return self.responses.pop(request.seq_num)
+        seq_nums = []
+        data = []
+        for request in requests:
+            self.seq_num += 1
+            request.seq_num = self.seq_num
+            self.response_events[self.seq_num] = trio.Event()
+            seq_nums.append(self.seq_num)
+            if self.debug:
+                print(f'Sending {request}')
+            data.append((request.to_json() + '\n').encode())
+            if self.debug_bytes:
+                print(f'Sending {data[-1]!r}')
+        responses: List[Optional[Response]] = []
+        try:
+            await self.process.stdin.send_all(b''.join(data))
+            for i, seq_num in enumerate(seq_nums):
+                await self.response_events[seq_num].wait()
+                if on_response and seq_num in self.responses:
+                    on_response(i, self.responses[seq_num])
+            responses = [self.responses.get(seq_num) for seq_num in seq_nums]
+        finally:
+            # Also when cancelled, the responses already received must not
+            # stay on a long lived server
+            for seq_num in seq_nums:
+                self.response_events.pop(seq_num)
+                self.responses.pop(seq_num, None)
+        if any(resp is None for resp in responses):
+            raise ValueError('Lean server stopped')
+        return responses
 
     async def receiver(self):
         """This task waits for Lean responses, updating the server state
         (tasks and messages) and triggering events when a response comes."""
         if not self.process:
             raise ValueError('No Lean server')
-        unfinished_message = b''
-        async for data in self.process.stdout:
-            lines = (unfinished_message + data).split(b'\n')
-            unfinished_message = lines.pop()  # usually empty, but can be half a message
-            for line in lines:
-                if self.debug_bytes:
-                    print(f'Received {line}')
-                resp = parse_response(line.decode())
-                if self.debug:
-                    print(f'Received {resp}')
-                if isinstance(resp, CurrentTasksResponse):
-                    self.current_tasks = resp.tasks
-                elif isinstance(resp, AllMessagesResponse):
-                    self.is_fully_ready.set()
-                    self.messages = resp.msgs
-                if hasattr(resp, 'seq_num'):
-                    self.responses[resp.seq_num] = resp
-                    self.response_events[resp.seq_num].set()
-
-    async def full_sync(self, filename, content=None) -> None:
-        """Fully compile a Lean file before returning."""
+        buffer = LineBuffer(self.max_message_size)
+        try:
+            async for data in self.process.stdout:
+                try:
+                    lines = buffer.feed(data)
+                except LeanMessageTooLargeError:
+                    # The rest of the output can't be trusted anymore
+                    self.kill()
+                    raise
+                for line in lines:
+                    if self.debug_bytes:
+                        print(f'Received {line}')
+                    resp = parse_response(line, self.subscriptions)
+                    if resp is None:
+                        continue
+                    if self.debug:
+                        print(f'Received {resp}')
+                    seq_num = getattr(resp, 'seq_num', None)
+                    if self.sync_seq_num is not None:
+                        if seq_num is not None and seq_num >= self.sync_seq_num:
+                            self.sync_seq_num = None
+                        elif isinstance(resp, (CurrentTasksResponse, AllMessagesResponse)):
+                            continue
+                    if isinstance(resp, CurrentTasksResponse):
+                        self.current_tasks = resp.tasks
+                        self.tasks_changed.set()
+                        self.tasks_changed = trio.Event()
+                    elif isinstance(resp, AllMessagesResponse):
+                        self.is_fully_ready.set()
+                        self.messages = resp.msgs
+                    if hasattr(resp, 'seq_num'):
+                        # The request may have been cancelled in the meantime
+                        event = self.response_events.get(resp.seq_num)
+                        if event:
+                            self.responses[resp.seq_num] = resp
+                            event.set()
+        finally:
+            # Wake up everyone still waiting on a server that went away
+            for event in self.response_events.values():
+                event.set()
+            self.is_fully_ready.set()
+            self.tasks_changed.set()
+
+    async def full_sync(self, filename, content=None, timeout: Optional[float] = None) -> bool:
+        """Fully compile a Lean file before returning. Returns False if the
+        timeout (in seconds) expired first, pending_tasks then tells how far
+        Lean went. When the file already has this content and its last check
+        finished, its messages are still current and it returns at once."""
         # Waiting for the response is not enough, so we prepare another event
-        await self.send(SyncRequest(filename, content))
-        await self.is_fully_ready.wait()
+        self.is_fully_ready = trio.Event()
+        # The tasks are only followed during the check
+        subscribed = 'current_tasks' in self.subscriptions
+        if not subscribed:
+            self.current_tasks = []
+            self.subscriptions.add('current_tasks')
+        try:
+            with trio.move_on_after(timeout if timeout is not None else math.inf):
+                resp = await self._send_sync(filename, content)
+                if self._is_unchanged(resp):
+                    if filename in self.checked and self.checked[filename] == content:
+                        return True
+                    # Lean may still be checking it for a call that timed out,
+                    # so it is emptied first to be checked again from scratch
+                    await self._send_sync(filename, '')
+                    self.is_fully_ready = trio.Event()
+                    await self._send_sync(filename, content)
+                self.checked.pop(filename, None)
+                await self.is_fully_ready.wait()
+                # Messages may come before the end of the check, the file is
+                # done once Lean has no more tasks for it
+                while self.is_alive() and self.pending_tasks(filename):
+                    await self.tasks_changed.wait()
+                self.checked[filename] = content
+                return True
+            return False
+        finally:
+            self.sync_seq_num = None
+            if not subscribed:
+                self.subscriptions.discard('current_tasks')
+
+    async def _send_sync(self, filename, content) -> Response:
+        # The next request sent gets this number
+        self.sync_seq_num = self.seq_num + 1
+        return await self.send(SyncRequest(filename, content))
+
+    @staticmethod
+    def _is_unchanged(resp: Response) -> bool:
+        return isinstance(resp, SyncResponse) and resp.message == 'file unchanged'
+
+    async def set_roi(self, filename, begin_line: int, end_line: int,
+                      mode: CheckingMode = CheckingMode['visible-lines-and-above']) -> None:
+        """Restrict Lean checking to the given lines of a single file, the
+        other files opened by this server are no longer checked."""
+        await self.send(RoiRequest(mode, [FileRoi(filename, [RoiRange(begin_line, end_line)])]))
+
+    def pending_tasks(self, filename) -> List[Task]:
+        """Tasks Lean still has to run on the given file."""
+        name = Path(filename).name
+        return [task for task in self.current_tasks
+                if Path(task.file_name).name == name]
 
     async def state(self, filename, line, col) -> str:
         """Tactic state"""
         resp = await self.send(InfoRequest(filename, line, col))
+        return self._record_state(resp)
+
+    async def states(self, filename, positions: List[Tuple[int, int]],
+                     on_state: Optional[Callable[[int, str], None]] = None) -> List[str]:
+        """Tactic states at each (line, col) position. The requests are
+        pipelined so this costs about one round trip. on_state is called with
+        the index of each position as soon as its state is known."""
+        on_response = None
+        if on_state:
+            def on_response(i, resp):
+                on_state(i, self._record_state(resp))
+        responses = await self.send_many(
+                [InfoRequest(filename, line, col) for line, col in positions],
+                on_response)
+        return [self._record_state(resp) for resp in responses]
+
+    @staticmethod
+    def _record_state(resp: Response) -> str:
         if isinstance(resp, InfoResponse) and resp.record:
             return resp.record.state or ''
         else:
             return ''
 
+    def is_alive(self) -> bool:
+        """Whether the Lean process is still running."""
+        return self.process is not None and self.process.returncode is None
+
     def kill(self):
         """Kill the Lean process."""
         self.process.kill()
+
+    async def stop(self, timeout: float = 1):
+        """Close the input of the Lean process and give it some time to exit
+        before killing it."""
+        with trio.move_on_after(timeout):
+            await self.process.stdin.aclose()
+            await self.process.wait()
+        if self.is_alive():
+            self.kill()
+
+    def age(self) -> float:
+        """Seconds since the Lean process was started."""
+        return time.monotonic() - self.started_at
+
+    def rss(self) -> Optional[int]:
+        """Resident memory of the Lean process in bytes, None if it can't be
+        read from /proc."""
+        try:
+            with open(f'/proc/{self.process.pid}/status') as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError, IndexError):
+            pass
+        return None
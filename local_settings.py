@@ -117,6 +117,40 @@ REST_FRAMEWORK = {
 
 TOKEN_EXPIRED_AFTER_SECONDS = 86400
 
+# Number of warm Lean servers kept by each process
+LEAN_POOL_SIZE = 2
+# Checks allowed to wait for a Lean server before new ones are refused
+LEAN_QUEUE_MAX = 20
+# Seconds a check waits for a Lean server before failing as unavailable
+LEAN_QUEUE_TIMEOUT = 60
+# Seconds Lean gets to check a proof before partial results are returned
+LEAN_SYNC_TIMEOUT = 10
+# Number of proof sessions remembered for incremental checks
+LEAN_SESSIONS_MAX = 1000
+# Proofs of a batch checked in a single Lean job, and seconds the whole batch
+# may take before its remaining proofs are given as timed out
+LEAN_BATCH_CHUNK = 10
+LEAN_BATCH_TIMEOUT = 120
+# Cache of Lean results. To share it between processes, use
+# "leanclient.cache.DjangoCacheBackend" with the alias of a FileBasedCache
+# in CACHES as option
+LEAN_STATES_CACHE = {
+    "BACKEND": "leanclient.cache.LocalLRUBackend",
+    "OPTIONS": {"max_size": 1000, "ttl": 3600},
+}
+# A Lean server is replaced after this many checks, seconds of life or bytes
+# of resident memory, None disables the limit
+LEAN_SERVER_MAX_JOBS = 500
+LEAN_SERVER_MAX_AGE = 6 * 3600
+LEAN_SERVER_MAX_RSS = 2 * 1024 ** 3
+# Limits of the proofs sent to be checked: number of hypotheses and of proof
+# lines, characters of a line and of all the lines together
+PROOF_MAX_LINES = 200
+PROOF_MAX_LINE_LENGTH = 1000
+PROOF_MAX_TOTAL_LENGTH = 50000
+# Seconds the translation of a line to Lean may take, None disables the limit
+PROOF_LINE_PARSE_BUDGET = 0.5
+
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 
 # Internationalization
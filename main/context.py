@@ -1,24 +1,154 @@
+from typing import Dict, Optional, Tuple
+
+# Classes and associated hypothesis of an identifier, None when it has none
+Entry = Tuple[Optional[frozenset], Optional[str]]
+
+
 class Context:
+    """Identifiers, current goal and number of anonymous hypotheses of a proof.
+
+    snapshot() gives an independent copy without copying the identifiers:
+    they are kept in layers shared by the snapshots, and the changes made
+    since the last snapshot are kept in an own layer. The layers are merged
+    once there are more than MAX_LAYERS of them."""
+
+    MAX_LAYERS = 32
+
     def __init__(self):
-        self.identifiers = {}
+        self.layers: Tuple[Dict[str, Entry], ...] = ()
+        self.own: Dict[str, Entry] = {}
         self.current_goal = None
         self.c_anonymous = 0
 
+    def _entry(self, ident) -> Optional[Entry]:
+        entry = self.own.get(ident)
+        if entry is not None:
+            return entry
+        for layer in reversed(self.layers):
+            entry = layer.get(ident)
+            if entry is not None:
+                return entry
+        return None
+
     def get(self, ident):
-        return self.identifiers.get(ident)
+        """Copy of the classes and associated hypothesis of ident."""
+        entry = self._entry(ident)
+        if entry is None:
+            return None
+        classes, hyp = entry
+        res = {}
+        if classes is not None:
+            res["class"] = set(classes)
+        if hyp is not None:
+            res["associate"] = hyp
+        return res
+
+    @property
+    def identifiers(self):
+        idents = set(self.own).union(*self.layers)
+        return {ident: self.get(ident) for ident in idents}
 
     def add(self, ident, name):
-        if ident not in self.identifiers:
-            self.identifiers[ident] = {}
-        if "class" not in self.identifiers[ident]:
-            self.identifiers[ident]["class"] = set()
-        self.identifiers[ident]["class"].add(name)
+        classes, hyp = self._entry(ident) or (None, None)
+        self.own[ident] = ((classes or frozenset()) | {name}, hyp)
 
     def associate(self, ident, hyp):
+        classes, _ = self._entry(ident) or (None, None)
+        self.own[ident] = (classes, hyp)
+
+    def snapshot(self) -> "Context":
+        """Copy of this context, in time independent of the number of
+        identifiers."""
+        if self.own:
+            self.layers += (self.own,)
+            self.own = {}
+        if len(self.layers) > self.MAX_LAYERS:
+            merged = {}
+            for layer in self.layers:
+                merged.update(layer)
+            self.layers = (merged,)
+        copy = Context()
+        copy.layers = self.layers
+        copy.current_goal = self.current_goal
+        copy.c_anonymous = self.c_anonymous
+        return copy
+
+    def next_anonymous(self):
+        self.c_anonymous += 1
+        return "A{}".format(self.c_anonymous)
+
+    def apply(self, effects):
+        """Replay the effects recorded by a DeferredContext."""
+        for effect, *args in effects:
+            getattr(self, effect)(*args)
+
+
+def goal_key(goal):
+    return None if goal is None else (type(goal), goal.to_lean())
+
+
+def freeze_identifier(entry):
+    if entry is None:
+        return None
+    return (frozenset(entry.get("class", ())), entry.get("associate"))
+
+
+class DeferredContext:
+    """Context seen by a parser that doesn't change the context it wraps.
+
+    Reads see the wrapped context and the changes made so far, the changes are
+    recorded in effects, to be applied with Context.apply, and the values of
+    the wrapped context that were looked at are recorded in reads. A parse
+    gives the same result and effects on any context matching its reads."""
+
+    def __init__(self, context):
+        self.context = context
+        self.identifiers = {}
+        self.c_anonymous = None
+        self.reads = {}
+        self.effects = []
+
+    @property
+    def current_goal(self):
+        goal = self.context.current_goal
+        self.reads["goal"] = goal_key(goal)
+        return goal
+
+    def _identifier(self, ident):
         if ident not in self.identifiers:
-            self.identifiers[ident] = {}
-        self.identifiers[ident]["associate"] = hyp
+            entry = self.context.get(ident)
+            self.reads[("identifier", ident)] = freeze_identifier(entry)
+            self.identifiers[ident] = entry
+        return self.identifiers[ident]
+
+    def get(self, ident):
+        return self._identifier(ident)
+
+    def add(self, ident, name):
+        entry = self._identifier(ident) or {}
+        entry.setdefault("class", set()).add(name)
+        self.identifiers[ident] = entry
+        self.effects.append(("add", ident, name))
+
+    def associate(self, ident, hyp):
+        entry = self._identifier(ident) or {}
+        entry["associate"] = hyp
+        self.identifiers[ident] = entry
+        self.effects.append(("associate", ident, hyp))
 
     def next_anonymous(self):
+        if self.c_anonymous is None:
+            self.c_anonymous = self.context.c_anonymous
+            self.reads["anonymous"] = self.c_anonymous
         self.c_anonymous += 1
+        self.effects.append(("next_anonymous",))
         return "A{}".format(self.c_anonymous)
+
+    @staticmethod
+    def read(context, key):
+        """Current value of a read key in a context."""
+        if key == "goal":
+            return goal_key(context.current_goal)
+        if key == "anonymous":
+            return context.c_anonymous
+        return freeze_identifier(context.get(key[1]))
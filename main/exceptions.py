@@ -8,3 +8,7 @@ class NaturalToLeanError(TranslationError):
 
 class LeanToNaturalError(TranslationError):
     pass
+
+
+class ParseTimeoutError(NaturalToLeanError):
+    pass
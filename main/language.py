@@ -1,7 +1,39 @@
-from typing import List, Type
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Set, Tuple, Type
+
+from main.context import DeferredContext
+from main.exceptions import ParseTimeoutError
+
+# First word, LaTeX command or character of a sentence
+LEADING_TOKEN = re.compile(r"[\w']+|\\[A-Za-z]+|.", re.DOTALL)
+
+
+def leading_token(s: str) -> str:
+    match = LEADING_TOKEN.match(s)
+    return match[0] if match else ""
 
 
 class Language:
+    # Leading tokens that every sentence matched by from_natural starts with,
+    # with in_math False and True, and by from_lean. None when a sentence can
+    # start with anything.
+    natural_tokens: Optional[Tuple[str, ...]] = None
+    math_tokens: Optional[Tuple[str, ...]] = None
+    lean_tokens: Optional[Tuple[str, ...]] = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for index, tokens in (
+            (NATURAL_INDEX, cls.natural_tokens),
+            (MATH_INDEX, cls.math_tokens),
+            (LEAN_INDEX, cls.lean_tokens),
+        ):
+            index.add(cls, tokens)
+
     def to_lean(self) -> str:
         raise NotImplementedError
 
@@ -17,8 +49,51 @@ class Language:
         raise NotImplementedError
 
 
+class DispatchIndex:
+    """Languages that may match a sentence, given its leading token. It is
+    filled as the Language subclasses are defined."""
+
+    def __init__(self):
+        self.by_token: Dict[str, Set[type]] = defaultdict(set)
+        # Languages only matching sentences starting with one of their tokens
+        self.restricted: Set[type] = set()
+
+    def add(self, lang, tokens):
+        if tokens is not None:
+            self.restricted.add(lang)
+            for token in tokens:
+                self.by_token[token].add(lang)
+
+    def candidates(self, s: str, languages):
+        """The languages, in the same order, that may match s."""
+        plausible = self.by_token.get(leading_token(s), ())
+        return [
+            lang
+            for lang in languages
+            if lang in plausible or lang not in self.restricted
+        ]
+
+
+# Sentence being parsed by parse_natural and time.monotonic() deadline of its
+# parse, None when its parse time isn't limited
+_budget: ContextVar = ContextVar("parse_budget", default=None)
+
+
+def check_budget():
+    budget = _budget.get()
+    if budget is not None and time.monotonic() > budget[1]:
+        raise ParseTimeoutError("Translating {} took too long".format(budget[0]))
+
+
+NATURAL_INDEX = DispatchIndex()
+MATH_INDEX = DispatchIndex()
+LEAN_INDEX = DispatchIndex()
+
+
 def from_natural(s, context, languages: List[Type[Language]], in_math=False):
-    for lang in languages:
+    index = MATH_INDEX if in_math else NATURAL_INDEX
+    for lang in index.candidates(s, languages):
+        check_budget()
         match = lang.from_natural(s, context, in_math)
         if match:
             return match
@@ -26,8 +101,93 @@ def from_natural(s, context, languages: List[Type[Language]], in_math=False):
 
 
 def from_lean(s, context, languages: List[Type[Language]]):
-    for lang in languages:
+    for lang in LEAN_INDEX.candidates(s, languages):
         match = lang.from_lean(s, context)
         if match:
             return match
     return None
+
+
+class ParseCache:
+    """Least recently used cache of parse results, keyed by the sentence and
+    the languages it is parsed with. As the result of a parse depends on the
+    context, every key keeps a few results with the parts of the context they
+    looked at, and a result is only reused on a context where those are
+    unchanged."""
+
+    def __init__(self, max_size=4096, max_variants=4):
+        self.max_size = max_size
+        self.max_variants = max_variants
+        self.entries: "OrderedDict[tuple, list]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, context):
+        """(match, effects) of a previous parse valid on context, or None."""
+        with self.lock:
+            variants = self.entries.get(key, ())
+            for variant in variants:
+                reads, match, effects = variant
+                if all(
+                    DeferredContext.read(context, read) == value
+                    for read, value in reads.items()
+                ):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return match, effects
+            self.misses += 1
+            return None
+
+    def set(self, key, reads, match, effects):
+        with self.lock:
+            variants = self.entries.setdefault(key, [])
+            variants.insert(0, (reads, match, effects))
+            del variants[self.max_variants :]
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+PARSE_CACHE = ParseCache()
+
+
+def _parse(parser, key, s, context, languages, *args):
+    cached = PARSE_CACHE.get(key, context)
+    if cached is not None:
+        return cached
+    deferred = DeferredContext(context)
+    match = parser(s, deferred, languages, *args)
+    PARSE_CACHE.set(key, deferred.reads, match, deferred.effects)
+    return match, deferred.effects
+
+
+def parse_natural(
+    s, context, languages: List[Type[Language]], in_math=False, budget=None
+):
+    """from_natural without changing context. Returns the match, which is
+    shared with other parses and must not be modified, and the effects to
+    apply to context with Context.apply. Raises ParseTimeoutError if the parse
+    takes more than budget seconds."""
+    key = ("natural", s, tuple(languages), in_math)
+    if budget is None:
+        return _parse(from_natural, key, s, context, languages, in_math)
+    token = _budget.set((s, time.monotonic() + budget))
+    try:
+        return _parse(from_natural, key, s, context, languages, in_math)
+    finally:
+        _budget.reset(token)
+
+
+def parse_lean(s, context, languages: List[Type[Language]]):
+    """from_lean without changing context, see parse_natural."""
+    key = ("lean", s, tuple(languages))
+    return _parse(from_lean, key, s, context, languages)
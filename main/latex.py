@@ -0,0 +1,49 @@
+"""
+Tokenizer of the LaTeX math expressions of the sentences.
+
+An expression is tokenized once, and the sentences parse their parts from the
+tokens instead of matching backtracking regexes on substrings, so parsing is
+linear in the length of the expression. A token is a word, a command such as
+\\frac, or a single other character. Spaces are kept one per token, as some
+sentences require exactly one space at a given place.
+"""
+import re
+from typing import List, Optional
+
+TOKEN_PATTERN = re.compile(r"\w+|\\[A-Za-z]+|.", re.DOTALL)
+
+
+def tokenize(s: str) -> List[str]:
+    return TOKEN_PATTERN.findall(s)
+
+
+def is_space(token: str) -> bool:
+    # Like the regexes, a new line isn't a space that can be ignored
+    return token.isspace() and token != "\n"
+
+
+def strip(tokens: List[str]) -> List[str]:
+    """The tokens without the spaces at both ends."""
+    start = 0
+    end = len(tokens)
+    while start < end and is_space(tokens[start]):
+        start += 1
+    while end > start and is_space(tokens[end - 1]):
+        end -= 1
+    return tokens[start:end]
+
+
+def rfind(tokens: List[str], token: str) -> int:
+    """Index of the last occurrence of token, -1 if there is none."""
+    for i in range(len(tokens) - 1, -1, -1):
+        if tokens[i] == token:
+            return i
+    return -1
+
+
+def unwrap_dollars(tokens: List[str]) -> Optional[List[str]]:
+    """The tokens of an expression written as $...$ without the dollars, None
+    if it isn't one."""
+    if len(tokens) < 2 or tokens[0] != "$" or tokens[-1] != "$":
+        return None
+    return tokens[1:-1]
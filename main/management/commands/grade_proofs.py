@@ -0,0 +1,185 @@
+import csv
+import os
+import shlex
+import time
+from collections import Counter
+from concurrent.futures import as_completed
+
+from django.core.management.base import BaseCommand
+
+from leanclient.client_wrapper import LEAN_DIR, states_text_async
+from leanclient.exceptions import LeanTimeoutError
+from leanclient.pool import LeanServerPool
+from leanclient.prelude import ensure_prelude
+from main.exceptions import NaturalToLeanError
+from main.models import ProofForTheoremUser, ProofVerification, split_lines
+from main.views import (
+    add_all_manager,
+    get_ask_state_result,
+    get_failure_result,
+    get_natural_to_lean_error,
+    save_verification,
+)
+
+
+def is_verified(proof):
+    try:
+        return proof.verification.is_current()
+    except ProofVerification.DoesNotExist:
+        return False
+
+
+def get_check_error(e):
+    return get_failure_result(
+        "checkError", "The proof could not be checked: {}".format(e)
+    )
+
+
+async def check_proof(server, text, lines, timeout):
+    start = time.monotonic()
+    try:
+        res = await states_text_async(server, text, lines, timeout=timeout)
+    except Exception as e:
+        # A timeout, or Lean failing on this proof, mustn't stop the others
+        res = e
+    return res, time.monotonic() - start
+
+
+class Command(BaseCommand):
+    help = (
+        "Check with Lean every submitted proof of a theorem statement, or of all "
+        "statements, on a pool of Lean servers, save their verification and write "
+        "a summary"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--statement", type=int, help="Id of the theorem statement to grade"
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Number of Lean servers, by default the number of CPUs",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=300,
+            help="Seconds Lean gets to check each proof",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Check again the proofs whose verification is up to date",
+        )
+        parser.add_argument(
+            "--output", help="CSV file receiving the result of each proof"
+        )
+        parser.add_argument(
+            "--lean",
+            default="lean",
+            help="Lean command, for example to grade with a fake Lean server",
+        )
+
+    def handle(self, *args, **options):
+        proofs = ProofForTheoremUser.objects.select_related(
+            "user", "theorem_statement", "verification"
+        ).order_by("theorem_statement_id", "id")
+        if options["statement"] is not None:
+            proofs = proofs.filter(theorem_statement_id=options["statement"])
+        proofs = list(proofs)
+        if not options["force"]:
+            proofs = [proof for proof in proofs if not is_verified(proof)]
+        if not proofs:
+            self.stdout.write("No proof to grade")
+            return
+        lean_cmd = shlex.split(options["lean"])
+        ensure_prelude(LEAN_DIR, lean_cmd)
+        pool = LeanServerPool(options["workers"], lean_cmd, cwd=LEAN_DIR)
+        try:
+            results = self.grade(pool, proofs, options["timeout"])
+        finally:
+            pool.close()
+        self.stdout.write("")
+        if options["output"]:
+            self.write_results(options["output"], proofs, results)
+        self.write_summary(results)
+
+    def grade(self, pool, proofs, timeout):
+        """Check the proofs on the pool and save their verification. Returns
+        the result of each proof by id. Identical proofs are checked once."""
+        results = {}
+        jobs = {}
+        futures = {}
+        for proof in proofs:
+            statement = proof.theorem_statement
+            try:
+                manager = add_all_manager(
+                    statement.name,
+                    statement.goal,
+                    split_lines(statement.hypotheses),
+                    split_lines(proof.proof),
+                )
+                text, lines = manager.to_lean()
+            except NaturalToLeanError as e:
+                results[proof.id] = get_natural_to_lean_error(e)
+                save_verification(proof, results[proof.id], 0)
+                continue
+            except Exception as e:
+                results[proof.id] = get_check_error(e)
+                save_verification(proof, results[proof.id], 0)
+                continue
+            key = (text, tuple(lines))
+            if key not in futures:
+                futures[key] = pool.submit(check_proof, text, lines, timeout)
+                jobs[futures[key]] = []
+            jobs[futures[key]].append((proof, manager, lines))
+        self.show_progress(len(results), len(proofs))
+        for future in as_completed(jobs):
+            try:
+                res, elapsed = future.result()
+            except Exception as e:
+                res, elapsed = e, 0
+            for proof, manager, lines in jobs[future]:
+                if isinstance(res, LeanTimeoutError):
+                    results[proof.id] = get_ask_state_result(
+                        manager, lines, res.states, res.err, res
+                    )
+                elif isinstance(res, Exception):
+                    results[proof.id] = get_check_error(res)
+                else:
+                    results[proof.id] = get_ask_state_result(manager, lines, *res)
+                save_verification(proof, results[proof.id], elapsed)
+            self.show_progress(len(results), len(proofs))
+        return results
+
+    def show_progress(self, done, total, width=40):
+        filled = width * done // total
+        self.stdout.write(
+            "\r[{}{}] {}/{}".format("#" * filled, "." * (width - filled), done, total),
+            ending="",
+        )
+        self.stdout.flush()
+
+    def write_results(self, path, proofs, results):
+        with open(path, "w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(["proof", "statement", "user", "status", "detail"])
+            for proof in proofs:
+                res = results[proof.id]
+                writer.writerow(
+                    [
+                        proof.id,
+                        proof.theorem_statement_id,
+                        proof.user.username,
+                        res["status"],
+                        res["detail"],
+                    ]
+                )
+
+    def write_summary(self, results):
+        counts = Counter(res["status"] for res in results.values())
+        for status_proof, count in counts.most_common():
+            self.stdout.write("{}: {}".format(status_proof, count))
+        self.stdout.write(self.style.SUCCESS("{} proofs graded".format(len(results))))
@@ -1,9 +1,12 @@
 import re
-from copy import deepcopy
 
+from django.conf import settings
+
+from leanclient.prelude import PRELUDE_MODULE
+from leanclient.timing import span
 from main.context import Context
 from main.exceptions import NaturalToLeanError, LeanToNaturalError
-from main.language import from_natural, from_lean
+from main.language import parse_natural, parse_lean
 from main.preprocess import preprocess
 from main.sentences import (
     RealValuedSequences,
@@ -34,18 +37,7 @@ from main.tactic import (
     GoalInequalityProperties,
 )
 
-HEADER = r"""import data.real.basic
-notation `|` x `|` := abs x
-@[user_attribute]
-meta def ineq_rules : user_attribute :=
-{ name := `ineq_rules,
-  descr := "lemmas usable to prove inequalities" }
-attribute [ineq_rules] add_lt_add le_max_left le_max_right
-meta def obvious_ineq := `[linarith <|> apply_rules ineq_rules]
-run_cmd add_interactive [`obvious_ineq]
-definition is_limit (a : ℕ → ℝ) (l : ℝ) :=
-∀ ε > 0, ∃ N, ∀ n ≥ N, | a n - l | < ε
-"""
+HEADER = "import " + PRELUDE_MODULE + "\n"
 
 START = len(HEADER.split("\n"))
 
@@ -66,10 +58,6 @@ def extract_goal(state):
     return match[1]
 
 
-def extract_goals(states):
-    return list(map(lambda state: extract_goal(state), states))
-
-
 def extract_error(msg):
     msg = msg.split("\n")
     index = 0
@@ -101,7 +89,8 @@ def extract_variable(state, ident):
 
 def lean_goal_to_nat(s, context):
     sentences_match = COMMON_SENTENCES
-    match = from_lean(s, context, sentences_match)
+    match, effects = parse_lean(s, context, sentences_match)
+    context.apply(effects)
     if not match:
         raise LeanToNaturalError()
     return match.to_natural()
@@ -114,7 +103,8 @@ def lean_error_to_nat(s, context):
 
 def lean_variable_to_nat(s, context):
     sentences_match = COMMON_SENTENCES
-    match = from_lean(s, context, sentences_match)
+    match, effects = parse_lean(s, context, sentences_match)
+    context.apply(effects)
     if not match:
         raise LeanToNaturalError()
     return match.to_natural()
@@ -131,7 +121,9 @@ def nat_tactic_to_lean(s, context):
 
 
 class Manager:
-    def __init__(self):
+    def __init__(self, timings=None):
+        # Optional leanclient.timing.Timings receiving the time of each stage
+        self.timings = timings
         self.context = Context()
         self.hypotheses = []
         self.initial_goal = None
@@ -142,22 +134,36 @@ class Manager:
         self.initial_context = None
 
     def add_hypothesis(self, nat):
-        nat = preprocess(nat)
+        with span(self.timings, "preprocess"):
+            nat = preprocess(nat)
         sentences_match = [RealValuedSequences, RealDeclaration, SequenceLimit, ForAll]
-        match = from_natural(nat, self.context, sentences_match)
+        with span(self.timings, "parse"):
+            match, effects = parse_natural(
+                nat,
+                self.context,
+                sentences_match,
+                budget=settings.PROOF_LINE_PARSE_BUDGET,
+            )
+        self.context.apply(effects)
         if not match:
             raise NaturalToLeanError("Unrecognized hypothesis {}".format(nat))
         self.hypotheses.append(match)
 
     def set_initial_goal(self, nat):
-        nat = preprocess(nat)
+        with span(self.timings, "preprocess"):
+            nat = preprocess(nat)
         goals_match = [SequenceLimit, ComposedSequenceLimit]
-        match = from_natural(nat, self.context, goals_match)
+        with span(self.timings, "parse"):
+            match, effects = parse_natural(
+                nat, self.context, goals_match, budget=settings.PROOF_LINE_PARSE_BUDGET
+            )
+        self.context.apply(effects)
         if not match:
             raise NaturalToLeanError("Unrecognized goal {}".format(nat))
         self.initial_goal = match
         self.context.current_goal = match
-        self.initial_context = deepcopy(self.context)
+        with span(self.timings, "copy_context"):
+            self.initial_context = self.context.snapshot()
 
     def ident_hypotheses(self):
         res = []
@@ -171,7 +177,8 @@ class Manager:
         return res
 
     def add_proof_line(self, nat):
-        nat = preprocess(nat)
+        with span(self.timings, "preprocess"):
+            nat = preprocess(nat)
         tactics_match = [
             DoAllSubgoals,
             LetGoalLimit,
@@ -191,12 +198,20 @@ class Manager:
             ByDefinitionOfAddFunction,
             GoalInequalityProperties,
         ]
-        match = from_natural(nat, self.context, tactics_match)
+        with span(self.timings, "parse"):
+            match, effects = parse_natural(
+                nat,
+                self.context,
+                tactics_match,
+                budget=settings.PROOF_LINE_PARSE_BUDGET,
+            )
+        self.context.apply(effects)
         if not match:
             raise NaturalToLeanError("Unrecognized tactic {}".format(nat))
         # TODO get lean response if needed
         self.proof.append({"type": "user", "obj": match})
-        self.contexts.append(deepcopy(self.context))
+        with span(self.timings, "copy_context"):
+            self.contexts.append(self.context.snapshot())
         self.to_extract.append(match.to_extract())
 
     def to_lean(self, header=True):
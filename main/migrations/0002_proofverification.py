@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProofVerification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('status', models.CharField(max_length=50)),
+                ('goal', models.TextField(blank=True)),
+                ('error', models.TextField(blank=True)),
+                ('elapsed', models.FloatField()),
+                ('checked_at', models.DateTimeField(auto_now=True)),
+                ('proof', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='verification', to='main.prooffortheoremuser')),
+            ],
+        ),
+    ]
@@ -1,7 +1,22 @@
+import hashlib
+import json
+
 from django.contrib.auth.models import User
 from django.db import models
 
 
+def split_lines(text):
+    """Hypotheses and proofs are stored either as a json list of lines or as
+    lines of text."""
+    try:
+        lines = json.loads(text)
+    except ValueError:
+        lines = None
+    if isinstance(lines, list):
+        return [str(line) for line in lines]
+    return [line for line in text.split("\n") if line.strip()]
+
+
 class TheoremStatement(models.Model):
     name = models.CharField(max_length=150)
     hypotheses = models.TextField()
@@ -16,3 +31,39 @@ class ProofForTheoremUser(models.Model):
 
     class Meta:
         unique_together = ["user", "theorem_statement"]
+
+    def content_hash(self):
+        """Hash of everything the result of a Lean check depends on."""
+        statement = self.theorem_statement
+        content = [statement.name, statement.hypotheses, statement.goal, self.proof]
+        return hashlib.sha256(json.dumps(content).encode("utf-8")).hexdigest()
+
+    def has_content(self, name, hypotheses, goal, proofs):
+        """Whether a check of these inputs is a check of this proof."""
+        statement = self.theorem_statement
+        return (
+            statement.name == name
+            and statement.goal == goal
+            and split_lines(statement.hypotheses) == list(hypotheses)
+            and split_lines(self.proof) == list(proofs)
+        )
+
+
+class ProofVerification(models.Model):
+    """Result of the last Lean check of a proof, by grade_proofs or by an
+    AskState or AskStateBatch check of exactly its content. It only holds
+    while the content hash matches the proof and its statement."""
+
+    proof = models.OneToOneField(
+        to=ProofForTheoremUser, on_delete=models.CASCADE, related_name="verification"
+    )
+    content_hash = models.CharField(max_length=64)
+    status = models.CharField(max_length=50)
+    goal = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    # Seconds taken by the check
+    elapsed = models.FloatField()
+    checked_at = models.DateTimeField(auto_now=True)
+
+    def is_current(self):
+        return self.content_hash == self.proof.content_hash()
@@ -2,6 +2,7 @@ from abc import ABC
 import re
 
 from main.language import Language, from_lean, from_natural
+from main.latex import rfind, strip, tokenize, unwrap_dollars
 
 from enum import Enum, auto
 
@@ -44,11 +45,53 @@ MAP_NAT_INEQ = {
 }
 
 
+LEAN_INEQ_SYMBOLS = "|".join(MAP_LEAN_INEQ.keys())
+
+# End of the left part of a \left ... \right pair
+RIGHT_PATTERN = re.compile(r"(.+) *\\right")
+
+
 class Sentence(Language, ABC):
     pass
 
 
+def _math_tokens(s, in_math, needed):
+    """Tokens of a math expression, None if s isn't written in $...$ while not
+    in_math or contains none of the needed strings, checked first as it is
+    cheaper than tokenizing."""
+    if not any(token in s for token in needed):
+        return None
+    tokens = tokenize(s)
+    if not in_math:
+        return unwrap_dollars(tokens)
+    return tokens
+
+
+def _from_atom(tokens, context, languages):
+    """Sentence of an expression made of a single token, an identifier or a
+    command."""
+    if len(tokens) != 1:
+        return None
+    return from_natural(tokens[0], context, languages, True)
+
+
+def _from_expression(tokens, context):
+    """Sentence of a side of an inequality."""
+    return (
+        AbsoluteDiff.from_tokens(tokens, context)
+        or Diff.from_tokens(tokens, context)
+        or Div.from_tokens(tokens, context)
+        or _from_atom(tokens, context, [ApplySequence, IdentifierEpsilon, Identifier])
+    )
+
+
 class IdentifierEpsilon(Language):
+    natural_tokens = (r"\epsilon",)
+    math_tokens = (r"\epsilon",)
+    lean_tokens = ("ε",)
+    natural_pattern = re.compile(r"\\epsilon")
+    lean_pattern = re.compile(r"ε")
+
     def to_lean(self) -> str:
         return "ε"
 
@@ -57,20 +100,23 @@ class IdentifierEpsilon(Language):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        match = re.fullmatch(r"\\epsilon", s)
+        match = cls.natural_pattern.fullmatch(s)
         if not match:
             return None
         return cls()
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"ε", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         return cls()
 
 
 class Identifier(Language):
+    natural_pattern = re.compile(r"(\w+)")
+    lean_pattern = re.compile(r"(\w+)")
+
     def __init__(self, ident):
         self.ident = ident
 
@@ -82,20 +128,25 @@ class Identifier(Language):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        match = re.fullmatch(r"(\w+)", s)
+        match = cls.natural_pattern.fullmatch(s)
         if not match:
             return None
         return cls(match[1])
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"(\w+)", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         return cls(match[1])
 
 
 class RealValuedSequences(Sentence):
+    natural_tokens = ("$",)
+    natural_pattern = re.compile(r"\$(\w+_n, )*(\w+_n)\$ are real-valued sequences")
+    math_pattern = re.compile(r"(\w+_n, )*(\w+_n)\$ are real-valued sequences \$")
+    lean_pattern = re.compile(r"(\w+ )+: ℕ → ℝ")
+
     def __init__(self, identifiers):
         self.identifiers = identifiers
 
@@ -122,9 +173,9 @@ class RealValuedSequences(Sentence):
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
         if not in_math:
-            match = re.fullmatch(r"\$(\w+_n, )*(\w+_n)\$ are real-valued sequences", s)
+            match = cls.natural_pattern.fullmatch(s)
         else:
-            match = re.fullmatch(r"(\w+_n, )*(\w+_n)\$ are real-valued sequences \$", s)
+            match = cls.math_pattern.fullmatch(s)
         if not match:
             return None
         identifiers = []
@@ -140,7 +191,7 @@ class RealValuedSequences(Sentence):
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"(\w+ )+: ℕ → ℝ", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         identifiers = []
@@ -154,6 +205,11 @@ class RealValuedSequences(Sentence):
 
 
 class RealDeclaration(Sentence):
+    natural_tokens = ("$",)
+    natural_pattern = re.compile(r"\$(\w+) \\in \\mathbb\{R\}\$")
+    math_pattern = re.compile(r"(\w+) \\in \\mathbb\{R\}")
+    lean_pattern = re.compile(r"(\w+) : ℝ")
+
     def __init__(self, ident):
         self.ident = ident
 
@@ -172,9 +228,9 @@ class RealDeclaration(Sentence):
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
         if not in_math:
-            match = re.fullmatch(r"\$(\w+) \\in \\mathbb\{R\}\$", s)
+            match = cls.natural_pattern.fullmatch(s)
         else:
-            match = re.fullmatch(r"(\w+) \\in \\mathbb\{R\}", s)
+            match = cls.math_pattern.fullmatch(s)
         if not match:
             return None
         context.add(match[1], "real")
@@ -182,7 +238,7 @@ class RealDeclaration(Sentence):
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"(\w+) : ℝ", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         context.add(match[1], "real")
@@ -190,6 +246,12 @@ class RealDeclaration(Sentence):
 
 
 class SequenceLimit(Sentence):
+    natural_tokens = ("$",)
+    lean_tokens = ("is_limit",)
+    natural_pattern = re.compile(r"\$(\w+)_n \\rightarrow (\w+)\$")
+    math_pattern = re.compile(r"(\w+)_n \\rightarrow (\w+)")
+    lean_pattern = re.compile(r"is_limit (\w+) (\w+)")
+
     def __init__(self, seq, lim):
         self.seq = seq
         self.lim = lim
@@ -209,22 +271,32 @@ class SequenceLimit(Sentence):
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
         if not in_math:
-            match = re.fullmatch(r"\$(\w+)_n \\rightarrow (\w+)\$", s)
+            match = cls.natural_pattern.fullmatch(s)
         else:
-            match = re.fullmatch(r"(\w+)_n \\rightarrow (\w+)", s)
+            match = cls.math_pattern.fullmatch(s)
         if not match:
             return None
         return cls(match[1], match[2])
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"is_limit (\w+) (\w+)", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         return cls(match[1], match[2])
 
 
 class ComposedSequenceLimit(Sentence):
+    natural_tokens = ("$",)
+    lean_tokens = ("is_limit",)
+    natural_pattern = re.compile(
+        r"\$(?:\\left)? *\((.+)\)_n *\\rightarrow *(?:\\left)? *\((.+)\)\$"
+    )
+    math_pattern = re.compile(
+        r"(?:\\left)? *\((.+)\)_n *\\rightarrow *(?:\\left)? *\((.+)\)"
+    )
+    lean_pattern = re.compile(r"is_limit \((.+)\) \((.+)\)")
+
     def __init__(self, seq, lim):
         self.seq = seq
         self.lim = lim
@@ -244,28 +316,24 @@ class ComposedSequenceLimit(Sentence):
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
         if not in_math:
-            match = re.fullmatch(
-                r"\$(?:\\left)? *\((.+)\)_n *\\rightarrow *(?:\\left)? *\((.+)\)\$", s
-            )
+            match = cls.natural_pattern.fullmatch(s)
         else:
-            match = re.fullmatch(
-                r"(?:\\left)? *\((.+)\)_n *\\rightarrow *(?:\\left)? *\((.+)\)", s
-            )
+            match = cls.math_pattern.fullmatch(s)
         if not match:
             return None
         match1 = match[1].strip()
         match2 = match[2].strip()
-        match1_match = re.fullmatch(r"(.+) *\\right", match1)
+        match1_match = RIGHT_PATTERN.fullmatch(match1)
         if match1_match:
             match1 = match1_match[1]
-        match2_match = re.fullmatch(r"(.+) *\\right", match2)
+        match2_match = RIGHT_PATTERN.fullmatch(match2)
         if match2_match:
             match2 = match2_match[1]
         return cls(match1, match2)
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"is_limit \((.+)\) \((.+)\)", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         return cls(match[1], match[2])
@@ -276,6 +344,9 @@ def _sentences_match_diff():
 
 
 class Diff(Sentence):
+    natural_tokens = ("$",)
+    lean_pattern = re.compile(r"(.+) - (.+)")
+
     def __init__(self, sentence1, sentence2):
         self.sentence1 = sentence1
         self.sentence2 = sentence2
@@ -288,25 +359,29 @@ class Diff(Sentence):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        if not in_math:
-            match = re.fullmatch(r"\$ ?(.+) ?- ?(.+) ?\$", s)
-        else:
-            match = re.fullmatch(r" ?(.+) ?- ?(.+) ?", s)
-        if not match:
+        tokens = _math_tokens(s, in_math, ("-",))
+        if tokens is None:
             return None
-        match1 = match[1].strip()
-        sentence1 = from_natural(match1, context, _sentences_match_diff(), True)
+        return cls.from_tokens(tokens, context)
+
+    @classmethod
+    def from_tokens(cls, tokens, context):
+        minus = rfind(tokens, "-")
+        if minus == -1:
+            return None
+        sentence1 = _from_atom(strip(tokens[:minus]), context, _sentences_match_diff())
         if not sentence1:
             return None
-        match2 = match[2].strip()
-        sentence2 = from_natural(match2, context, _sentences_match_diff(), True)
+        sentence2 = _from_atom(
+            strip(tokens[minus + 1 :]), context, _sentences_match_diff()
+        )
         if not sentence2:
             return None
         return cls(sentence1, sentence2)
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"(.+) - (.+)", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         sentence1 = from_lean(match[1], context, _sentences_match_diff())
@@ -323,6 +398,10 @@ def _sentences_match_div():
 
 
 class Div(Sentence):
+    natural_tokens = ("$",)
+    math_tokens = (r"\frac",)
+    lean_pattern = re.compile(r"(.+)\\(.+)")
+
     def __init__(self, sentence1, sentence2):
         self.sentence1 = sentence1
         self.sentence2 = sentence2
@@ -341,23 +420,33 @@ class Div(Sentence):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        if not in_math:
-            match = re.fullmatch(r"\$\\frac\{ ?(.+)\}\{ ?(.+)\}\$", s)
-        else:
-            match = re.fullmatch(r"\\frac\{ ?(.+)\}\{ ?(.+)\}", s)
-        if not match:
+        tokens = _math_tokens(s, in_math, (r"\frac",))
+        if tokens is None:
             return None
-        sentence1 = from_natural(match[1], context, _sentences_match_div(), True)
-        if not sentence1:
-            return None
-        sentence2 = from_natural(match[2], context, _sentences_match_div(), True)
-        if not sentence2:
-            return None
-        return cls(sentence1, sentence2)
+        return cls.from_tokens(tokens, context)
+
+    @classmethod
+    def from_tokens(cls, tokens, context):
+        # \frac{ a}{ b}, the spaces being optional
+        if tokens[:2] != [r"\frac", "{"] or tokens[-1:] != ["}"]:
+            return None
+        middle = rfind(tokens, "{")
+        if middle < 3 or tokens[middle - 1] != "}":
+            return None
+        parts = [tokens[2 : middle - 1], tokens[middle + 1 : -1]]
+        sentences = []
+        for part in parts:
+            if part and part[0] == " ":
+                part = part[1:]
+            sentence = _from_atom(part, context, _sentences_match_div())
+            if not sentence:
+                return None
+            sentences.append(sentence)
+        return cls(*sentences)
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"(.+)\\(.+)", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         sentence1 = from_lean(match[1], context, _sentences_match_div())
@@ -374,6 +463,9 @@ def _sentences_match_inequality():
 
 
 class Inequality(Sentence):
+    natural_tokens = ("$",)
+    lean_pattern = re.compile(r"(.+) (" + LEAN_INEQ_SYMBOLS + r") (.+)")
+
     def __init__(self, ident1, ineq_type, ident2):
         self.ident1 = ident1
         self.ineq_type = ineq_type
@@ -405,25 +497,33 @@ class Inequality(Sentence):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        ineq_symbols = r">|\\geq|\\ge|<|\\leq|\\le"
-        if not in_math:
-            match = re.fullmatch(r"\$(.+) (" + ineq_symbols + r") (.+)\$", s)
-        else:
-            match = re.fullmatch(r"(.+) (" + ineq_symbols + r") (.+)", s)
-        if not match:
+        tokens = _math_tokens(s, in_math, ("<", ">", r"\ge", r"\le"))
+        if tokens is None:
+            return None
+        return cls.from_tokens(tokens, context)
+
+    @classmethod
+    def from_tokens(cls, tokens, context):
+        # No side can contain an inequality symbol, so there must be only one
+        symbols = [i for i, token in enumerate(tokens) if token in MAP_NAT_INEQ]
+        if len(symbols) != 1:
+            return None
+        i = symbols[0]
+        if i < 2 or i > len(tokens) - 3:
             return None
-        ident1 = from_natural(match[1], context, _sentences_match_inequality(), True)
+        if tokens[i - 1] != " " or tokens[i + 1] != " ":
+            return None
+        ident1 = _from_expression(tokens[: i - 1], context)
         if not ident1:
             return None
-        ident2 = from_natural(match[3], context, _sentences_match_inequality(), True)
+        ident2 = _from_expression(tokens[i + 2 :], context)
         if not ident2:
             return None
-        return cls(ident1, MAP_NAT_INEQ[match[2]], ident2)
+        return cls(ident1, MAP_NAT_INEQ[tokens[i]], ident2)
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        ineq_symbols = "|".join(MAP_LEAN_INEQ.keys())
-        match = re.fullmatch(r"(.+) (" + ineq_symbols + r") (.+)", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         ident1 = from_lean(match[1], context, _sentences_match_inequality())
@@ -448,6 +548,11 @@ def _apply_sequence_if(match, cls, context):
 
 
 class ApplySequence(Sentence):
+    natural_tokens = ("$",)
+    natural_pattern = re.compile(r"\$(\w+)_(\w+)\$")
+    math_pattern = re.compile(r"(\w+)_(\w+)")
+    lean_pattern = re.compile(r"(\w+) (\w+)")
+
     def __init__(self, ident, point):
         self.ident = ident
         self.point = point
@@ -468,14 +573,14 @@ class ApplySequence(Sentence):
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
         if not in_math:
-            match = re.fullmatch(r"\$(\w+)_(\w+)\$", s)
+            match = cls.natural_pattern.fullmatch(s)
         else:
-            match = re.fullmatch(r"(\w+)_(\w+)", s)
+            match = cls.math_pattern.fullmatch(s)
         return _apply_sequence_if(match, cls, context)
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"(\w+) (\w+)", s)
+        match = cls.lean_pattern.fullmatch(s)
         return _apply_sequence_if(match, cls, context)
 
 
@@ -484,6 +589,13 @@ def _sentences_match_forall():
 
 
 class ForAll(Sentence):
+    natural_tokens = ("$",)
+    math_tokens = (r"\forall",)
+    lean_tokens = ("∀",)
+    natural_pattern = re.compile(r"\$\\forall (\w+) : (.+)\$")
+    math_pattern = re.compile(r"\\forall (\w+) : (.+)")
+    lean_pattern = re.compile(r"∀ (\w+), (.+)")
+
     def __init__(self, ident, sentence: Sentence):
         self.ident = ident
         self.sentence = sentence
@@ -503,9 +615,9 @@ class ForAll(Sentence):
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
         if not in_math:
-            match = re.fullmatch(r"\$\\forall (\w+) : (.+)\$", s)
+            match = cls.natural_pattern.fullmatch(s)
         else:
-            match = re.fullmatch(r"\\forall (\w+) : (.+)", s)
+            match = cls.math_pattern.fullmatch(s)
         if not match:
             return None
         sentence = from_natural(match[2], context, _sentences_match_forall(), True)
@@ -515,7 +627,7 @@ class ForAll(Sentence):
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"∀ (\w+), (.+)", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         sentence = from_lean(match[2], context, _sentences_match_forall())
@@ -525,6 +637,14 @@ class ForAll(Sentence):
 
 
 class ForAllNatIneqThen(Sentence):
+    natural_tokens = ("$",)
+    math_tokens = ("$",)
+    lean_tokens = ("∀",)
+    natural_pattern = re.compile(
+        r"\$\\forall (\w+) \\in \\mathbb\{N\} : (.+) \\Rightarrow (.+)\$"
+    )
+    lean_pattern = re.compile(r"∀ \((\w+) : ℕ\), (.+) → (.+)")
+
     def __init__(self, ident, ineq, sentence):
         self.ident = ident
         self.ineq = ineq
@@ -548,9 +668,7 @@ class ForAllNatIneqThen(Sentence):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        match = re.fullmatch(
-            r"\$\\forall (\w+) \\in \\mathbb\{N\} : (.+) \\Rightarrow (.+)\$", s
-        )
+        match = cls.natural_pattern.fullmatch(s)
         if not match:
             return None
         ident = match[1]
@@ -562,7 +680,7 @@ class ForAllNatIneqThen(Sentence):
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"∀ \((\w+) : ℕ\), (.+) → (.+)", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         ident = match[1]
@@ -578,6 +696,14 @@ def _sentences_match_absolutediff():
 
 
 class AbsoluteDiff(Sentence):
+    natural_tokens = ("$",)
+    math_tokens = (
+        r"\left",
+        "|",
+    )
+    lean_tokens = ("|",)
+    lean_pattern = re.compile(r"\|(.+) - (.+)\|")
+
     def __init__(self, sentence1, sentence2):
         self.sentence1 = sentence1
         self.sentence2 = sentence2
@@ -600,28 +726,39 @@ class AbsoluteDiff(Sentence):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        if not in_math:
-            match = re.fullmatch(r"\$ ?(?:\\left)?\| ?(.+) ?- ?(.+)\|\$", s)
-        else:
-            match = re.fullmatch(r"(?:\\left)?\| ?(.+) ?- ?(.+)\|", s)
-        if not match:
+        tokens = _math_tokens(s, in_math, ("|",))
+        if tokens is None:
             return None
-        match1 = match[1].strip()
-        sentence1 = from_natural(match1, context, _sentences_match_absolutediff(), True)
+        if not in_math and tokens and tokens[0] == " ":
+            tokens = tokens[1:]
+        return cls.from_tokens(tokens, context)
+
+    @classmethod
+    def from_tokens(cls, tokens, context):
+        # \left|a - b \right|, \left and \right being optional
+        if tokens and tokens[0] == r"\left":
+            tokens = tokens[1:]
+        if len(tokens) < 2 or tokens[0] != "|" or tokens[-1] != "|":
+            return None
+        tokens = tokens[1:-1]
+        minus = rfind(tokens, "-")
+        if minus == -1:
+            return None
+        part1 = strip(tokens[:minus])
+        sentence1 = _from_atom(part1, context, _sentences_match_absolutediff())
         if not sentence1:
             return None
-        match2 = match[2].strip()
-        match2_match = re.fullmatch(r"(.+) \\right", match2)
-        if match2_match:
-            match2 = match2_match[1]
-        sentence2 = from_natural(match2, context, _sentences_match_absolutediff(), True)
+        part2 = strip(tokens[minus + 1 :])
+        if len(part2) > 2 and part2[-2] == " " and part2[-1] == r"\right":
+            part2 = part2[:-2]
+        sentence2 = _from_atom(part2, context, _sentences_match_absolutediff())
         if not sentence2:
             return None
         return cls(sentence1, sentence2)
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"\|(.+) - (.+)\|", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         sentence1 = from_lean(match[1], context, _sentences_match_absolutediff())
@@ -1,7 +1,24 @@
+from django.conf import settings
 from django.contrib.auth.models import User
 from rest_framework import serializers
 
-from main.models import TheoremStatement, ProofForTheoremUser
+from main.models import TheoremStatement, ProofForTheoremUser, ProofVerification
+
+
+def check_lines(lines):
+    """Enforce the PROOF_MAX_LINES and PROOF_MAX_LINE_LENGTH settings."""
+    if len(lines) > settings.PROOF_MAX_LINES:
+        raise serializers.ValidationError(
+            "At most {} lines are allowed".format(settings.PROOF_MAX_LINES)
+        )
+    for line in lines:
+        if len(line) > settings.PROOF_MAX_LINE_LENGTH:
+            raise serializers.ValidationError(
+                "A line has at most {} characters".format(
+                    settings.PROOF_MAX_LINE_LENGTH
+                )
+            )
+    return lines
 
 
 class AskStateSerializer(serializers.Serializer):
@@ -9,6 +26,37 @@ class AskStateSerializer(serializers.Serializer):
     hypotheses = serializers.ListField(child=serializers.CharField(), allow_empty=False)
     goal = serializers.CharField(allow_blank=False)
     proofs = serializers.ListField(child=serializers.CharField(), allow_empty=True)
+    session = serializers.CharField(required=False, max_length=64)
+
+    def validate_name(self, value):
+        check_lines([value])
+        return value
+
+    def validate_hypotheses(self, value):
+        return check_lines(value)
+
+    def validate_goal(self, value):
+        check_lines([value])
+        return value
+
+    def validate_proofs(self, value):
+        return check_lines(value)
+
+    def validate(self, attrs):
+        lines = [attrs["name"], attrs["goal"]] + attrs["hypotheses"] + attrs["proofs"]
+        if sum(map(len, lines)) > settings.PROOF_MAX_TOTAL_LENGTH:
+            raise serializers.ValidationError(
+                "A proof has at most {} characters".format(
+                    settings.PROOF_MAX_TOTAL_LENGTH
+                )
+            )
+        return attrs
+
+
+class AskStateBatchSerializer(serializers.Serializer):
+    items = serializers.ListField(
+        child=AskStateSerializer(), allow_empty=False, max_length=100
+    )
 
 
 class TheoremStatementSerializer(serializers.ModelSerializer):
@@ -68,9 +116,25 @@ class LightProofForTheoremUserSerializer(serializers.ModelSerializer):
         fields = ["id", "theorem_statement", "user"]
 
 
+class ProofVerificationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProofVerification
+        fields = ["status", "goal", "error", "elapsed", "checked_at"]
+
+
 class ListFormatProofForTheoremUserSerializer(serializers.ModelSerializer):
     user = UserSerializer()
+    verification = serializers.SerializerMethodField()
 
     class Meta:
         model = ProofForTheoremUser
-        fields = ["id", "user", "theorem_statement"]
+        fields = ["id", "user", "theorem_statement", "verification"]
+
+    def get_verification(self, obj):
+        try:
+            verification = obj.verification
+        except ProofVerification.DoesNotExist:
+            return None
+        if not verification.is_current():
+            return None
+        return ProofVerificationSerializer(verification).data
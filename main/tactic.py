@@ -24,6 +24,11 @@ def _sentences_match_letgoallimit():
 
 
 class LetGoalLimit(Tactic):
+    natural_tokens = ("Let",)
+    lean_tokens = ("intros",)
+    natural_pattern = re.compile(r"Let \$(\\?\w+)\$")
+    lean_pattern = re.compile(r"intros (\w+) (\w+)")
+
     def __init__(self, ident, hyp):
         self.ident = ident
         self.hyp = hyp
@@ -36,7 +41,7 @@ class LetGoalLimit(Tactic):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        match = re.fullmatch(r"Let \$(\\?\w+)\$", s)
+        match = cls.natural_pattern.fullmatch(s)
         if not match:
             return None
         if not isinstance(context.current_goal, SequenceLimit) and not isinstance(
@@ -54,7 +59,7 @@ class LetGoalLimit(Tactic):
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"intros (\w+) (\w+)", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         if not isinstance(context.current_goal, SequenceLimit) and not isinstance(
@@ -77,6 +82,13 @@ def _sentences_match_choosenepsilonlimit():
 
 
 class ChooseNEpsilonLimit(Tactic):
+    natural_tokens = ("Let's",)
+    lean_tokens = ("cases",)
+    natural_pattern = re.compile(
+        r"Let's choose \$(\w+)\$ such that (\w+) uses \$(.+)\$"
+    )
+    lean_pattern = re.compile(r"cases (\w+) (\w+) (\w+) with (\w+) (\w+)")
+
     def __init__(self, limit_def, eps, hyp_eps, n_chosen, hyp_n):
         self.limit_def = limit_def
         self.eps = eps
@@ -111,7 +123,7 @@ class ChooseNEpsilonLimit(Tactic):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        match = re.fullmatch(r"Let's choose \$(\w+)\$ such that (\w+) uses \$(.+)\$", s)
+        match = cls.natural_pattern.fullmatch(s)
         if not match:
             return None
         n_chosen = match[1]
@@ -130,7 +142,7 @@ class ChooseNEpsilonLimit(Tactic):
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"cases (\w+) (\w+) (\w+) with (\w+) (\w+)", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         limit_def = match[1]
@@ -145,6 +157,13 @@ class ChooseNEpsilonLimit(Tactic):
 
 
 class ChooseNEpsilonLimitWith(Tactic):
+    natural_tokens = ("Let's",)
+    lean_tokens = ("cases",)
+    natural_pattern = re.compile(
+        r"Let's choose \$(\w+)\$ such that (\w+) uses \$(.+)\$ \(with (\w+)\)"
+    )
+    lean_pattern = re.compile(r"cases (\w+) (\w+) (\w+) with (\w+) (\w+)")
+
     def __init__(self, limit_def, eps, hyp_eps, n_chosen, hyp_n):
         self.limit_def = limit_def
         self.eps = eps
@@ -179,9 +198,7 @@ class ChooseNEpsilonLimitWith(Tactic):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        match = re.fullmatch(
-            r"Let's choose \$(\w+)\$ such that (\w+) uses \$(.+)\$ \(with (\w+)\)", s
-        )
+        match = cls.natural_pattern.fullmatch(s)
         if not match:
             return None
         n_chosen = match[1]
@@ -198,7 +215,7 @@ class ChooseNEpsilonLimitWith(Tactic):
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"cases (\w+) (\w+) (\w+) with (\w+) (\w+)", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         limit_def = match[1]
@@ -213,6 +230,13 @@ class ChooseNEpsilonLimitWith(Tactic):
 
 
 class LetMax(Tactic):
+    natural_tokens = ("Let",)
+    lean_tokens = ("let",)
+    natural_pattern = re.compile(
+        r"Let \$(\w+) ?= ?\\?max ?(?:\\left)?\((\w+), (\w+) ?(?:\\right)?\)\$"
+    )
+    lean_pattern = re.compile(r"let (\w+) := max (\w+) (\w+)")
+
     def __init__(self, ident, ident1, ident2):
         self.ident = ident
         self.ident1 = ident1
@@ -234,16 +258,14 @@ class LetMax(Tactic):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        match = re.fullmatch(
-            r"Let \$(\w+) ?= ?\\?max ?(?:\\left)?\((\w+), (\w+) ?(?:\\right)?\)\$", s
-        )
+        match = cls.natural_pattern.fullmatch(s)
         if not match:
             return None
         return cls(match[1], match[2], match[3])
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"let (\w+) := max (\w+) (\w+)", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         return cls(match[1], match[2], match[3])
@@ -253,6 +275,11 @@ class LetMax(Tactic):
 
 
 class Use(Tactic):
+    natural_tokens = ("We",)
+    lean_tokens = ("use",)
+    natural_pattern = re.compile(r"We claim \$(.+)\$ works")
+    lean_pattern = re.compile(r"use (.+)")
+
     def __init__(self, expr):
         self.expr = expr
 
@@ -264,14 +291,14 @@ class Use(Tactic):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        match = re.fullmatch(r"We claim \$(.+)\$ works", s)
+        match = cls.natural_pattern.fullmatch(s)
         if not match:
             return None
         return cls(match[1])
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"use (.+)", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         return cls(match[1])
@@ -285,6 +312,11 @@ def _sentences_match_byinequalityproperties():
 
 
 class ByInequalityProperties(Tactic):
+    natural_tokens = ("By",)
+    lean_tokens = ("have",)
+    natural_pattern = re.compile(r"By inequality properties, (.+)")
+    lean_pattern = re.compile(r"have (\w+) : (.+) := by obvious_ineq")
+
     def __init__(self, ident, sentence):
         self.ident = ident
         self.sentence = sentence
@@ -303,7 +335,7 @@ class ByInequalityProperties(Tactic):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        match = re.fullmatch(r"By inequality properties, (.+)", s)
+        match = cls.natural_pattern.fullmatch(s)
         if not match:
             return None
         sentence = from_natural(
@@ -316,7 +348,7 @@ class ByInequalityProperties(Tactic):
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"have (\w+) : (.+) := by obvious_ineq", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         sentence = from_lean(
@@ -331,6 +363,11 @@ class ByInequalityProperties(Tactic):
 
 
 class LetNInequality(Tactic):
+    natural_tokens = ("Let",)
+    lean_tokens = ("intros",)
+    natural_pattern = re.compile(r"Let \$(\w+)\$")
+    lean_pattern = re.compile(r"intros (\w+) (\w+)")
+
     def __init__(self, ident, hyp):
         self.ident = ident
         self.hyp = hyp
@@ -343,7 +380,7 @@ class LetNInequality(Tactic):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        match = re.fullmatch(r"Let \$(\w+)\$", s)
+        match = cls.natural_pattern.fullmatch(s)
         if not match:
             return None
         if not isinstance(context.current_goal, ForAllNatIneqThen):
@@ -354,7 +391,7 @@ class LetNInequality(Tactic):
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"intros (\w+) (\w+)", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         if not isinstance(context.current_goal, ForAllNatIneqThen):
@@ -372,6 +409,10 @@ def _sentences_match_bysentencewith():
 
 
 class BySentenceWith(Tactic):
+    lean_tokens = ("have",)
+    natural_pattern = re.compile(r"(.+) by (\w+) with (\w+)")
+    lean_pattern = re.compile(r"have (\w+) : (.+) := (\w+) (\w+)")
+
     def __init__(self, ident, sentence, hyp, with_w):
         self.ident = ident
         self.sentence = sentence
@@ -395,7 +436,7 @@ class BySentenceWith(Tactic):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        match = re.fullmatch(r"(.+) by (\w+) with (\w+)", s)
+        match = cls.natural_pattern.fullmatch(s)
         if not match:
             return None
         sentence = from_natural(match[1], context, _sentences_match_bysentencewith())
@@ -406,7 +447,7 @@ class BySentenceWith(Tactic):
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"have (\w+) : (.+) := (\w+) (\w+)", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         sentence = from_lean(match[2], context, _sentences_match_bysentencewith())
@@ -419,6 +460,11 @@ class BySentenceWith(Tactic):
 
 
 class LetsChooseIn(Tactic):
+    natural_tokens = ("Let's",)
+    lean_tokens = ("have",)
+    natural_pattern = re.compile(r"Let's choose (\w+) in (\w+)")
+    lean_pattern = re.compile(r"have (\w+) := (\w+) (\w+)")
+
     def __init__(self, ident, hyp, point):
         self.ident = ident
         self.hyp = hyp
@@ -432,7 +478,7 @@ class LetsChooseIn(Tactic):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        match = re.fullmatch(r"Let's choose (\w+) in (\w+)", s)
+        match = cls.natural_pattern.fullmatch(s)
         if not match:
             return None
         ident = context.next_anonymous()
@@ -440,7 +486,7 @@ class LetsChooseIn(Tactic):
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"have (\w+) := (\w+) (\w+)", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         return cls(match[1], match[2], match[3])
@@ -450,6 +496,13 @@ class LetsChooseIn(Tactic):
 
 
 class AbsoluteValueIneqProperty(Tactic):
+    natural_tokens = ("Let's",)
+    lean_tokens = ("rw",)
+    natural_pattern = re.compile(
+        r"Let's use absolute value inequality property on((:? \w+)*) and on (\w+)"
+    )
+    lean_pattern = re.compile(r"rw abs_sub_lt_iff at((?: (?:\w+|⊢))+)")
+
     def __init__(self, identifiers):
         self.identifiers = identifiers
 
@@ -470,10 +523,7 @@ class AbsoluteValueIneqProperty(Tactic):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        match = re.fullmatch(
-            r"Let's use absolute value inequality property on((:? \w+)*) and on (\w+)",
-            s,
-        )
+        match = cls.natural_pattern.fullmatch(s)
         if not match:
             return None
         firsts = match[1]
@@ -485,7 +535,7 @@ class AbsoluteValueIneqProperty(Tactic):
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"rw abs_sub_lt_iff at((?: (?:\w+|⊢))+)", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         idents = match[1].split(" ")
@@ -504,6 +554,11 @@ class AbsoluteValueIneqProperty(Tactic):
 
 
 class Cases(Tactic):
+    natural_tokens = ("Let's",)
+    lean_tokens = ("cases",)
+    natural_pattern = re.compile(r"Let's separate (\w+)")
+    lean_pattern = re.compile(r"cases (\w+)")
+
     def __init__(self, ident):
         self.ident = ident
 
@@ -515,14 +570,14 @@ class Cases(Tactic):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        match = re.fullmatch(r"Let's separate (\w+)", s)
+        match = cls.natural_pattern.fullmatch(s)
         if not match:
             return None
         return cls(match[1])
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"cases (\w+)", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         return cls(match[1])
@@ -532,6 +587,11 @@ class Cases(Tactic):
 
 
 class SplitGoal(Tactic):
+    natural_tokens = ("Let's",)
+    lean_tokens = ("split",)
+    natural_pattern = re.compile(r"Let's split the goal")
+    lean_pattern = re.compile(r"split")
+
     def to_lean(self) -> str:
         return "split"
 
@@ -540,14 +600,14 @@ class SplitGoal(Tactic):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        match = re.fullmatch(r"Let's split the goal", s)
+        match = cls.natural_pattern.fullmatch(s)
         if not match:
             return None
         return cls()
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"split", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         return cls()
@@ -561,6 +621,9 @@ def _sentences_match_doallsubgoals():
 
 
 class DoAllSubgoals(Tactic):
+    natural_pattern = re.compile(r"(.+) and do on all subgoals")
+    lean_pattern = re.compile(r"(.+);")
+
     def __init__(self, tactic):
         self.tactic = tactic
 
@@ -572,7 +635,7 @@ class DoAllSubgoals(Tactic):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        match = re.fullmatch(r"(.+) and do on all subgoals", s)
+        match = cls.natural_pattern.fullmatch(s)
         if not match:
             return None
         tactic = from_natural(match[1], context, _sentences_match_doallsubgoals())
@@ -582,7 +645,7 @@ class DoAllSubgoals(Tactic):
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"(.+);", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         tactic = from_lean(match[1], context, _sentences_match_doallsubgoals())
@@ -595,6 +658,11 @@ class DoAllSubgoals(Tactic):
 
 
 class LinearArithmetic(Tactic):
+    natural_tokens = ("By",)
+    lean_tokens = ("linarith",)
+    natural_pattern = re.compile(r"By linear arithmetic")
+    lean_pattern = re.compile(r"linarith")
+
     def to_lean(self) -> str:
         return "linarith"
 
@@ -603,14 +671,14 @@ class LinearArithmetic(Tactic):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        match = re.fullmatch(r"By linear arithmetic", s)
+        match = cls.natural_pattern.fullmatch(s)
         if not match:
             return None
         return cls()
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"linarith", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         return cls()
@@ -620,6 +688,11 @@ class LinearArithmetic(Tactic):
 
 
 class ByWith(Tactic):
+    natural_tokens = ("By",)
+    lean_tokens = ("have",)
+    natural_pattern = re.compile(r"By (\w+) with (\w+)")
+    lean_pattern = re.compile(r"have (\w+) := (\w+) (\w+)")
+
     def __init__(self, ident1, ident2, ident):
         self.ident1 = ident1
         self.ident2 = ident2
@@ -633,7 +706,7 @@ class ByWith(Tactic):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        match = re.fullmatch(r"By (\w+) with (\w+)", s)
+        match = cls.natural_pattern.fullmatch(s)
         if not match:
             return None
         ident = context.next_anonymous()
@@ -641,7 +714,7 @@ class ByWith(Tactic):
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r"have (\w+) := (\w+) (\w+)", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         return cls(match[2], match[3], match[1])
@@ -651,6 +724,27 @@ class ByWith(Tactic):
 
 
 class ByDefinitionOfAddFunction(Tactic):
+    natural_tokens = ("$",)
+    lean_tokens = ("have",)
+    natural_pattern = re.compile(
+        r"\$ *"
+        r"(?:\\left)?\( *(\w+(?: *\+ *\w+)*) *(?:\\right)?\)_(\w+)"
+        r" *= *"
+        r"(\w+_\w+(?: *\+ *\w+_\w+)*)"
+        r" *\$ *by definition of addition for functions"
+    )
+    lean_pattern = re.compile(
+        r"have +(\w+) *: *\( *"
+        r"(\w+(?: *\+ *\w+)*)\)"
+        r" *(\w+)"
+        " *= *"
+        r"(\w+ +\w+(?: *\+ *\w+ +\w+))"
+        r" *:= *pi.add_apply +(\w+ +(?:\w+ +)\w+)"
+    )
+    idents_pattern = re.compile(r"(\w+)(?: *\+ *(\w+))*")
+    applied_pattern = re.compile(r"(\w+)_(\w+)(?: *\+ *(?:(\w+)_(\w+))*)")
+    lean_applied_pattern = re.compile(r"(\w+) +(\w+)(?: *\+ *\w+ +(\w+))")
+
     def __init__(self, idents, point, ident):
         self.idents = idents
         self.point = point
@@ -686,22 +780,17 @@ class ByDefinitionOfAddFunction(Tactic):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        pattern = r"\$ *"
-        pattern += r"(?:\\left)?\( *(\w+(?: *\+ *\w+)*) *(?:\\right)?\)_(\w+)"
-        pattern += r" *= *"
-        pattern += r"(\w+_\w+(?: *\+ *\w+_\w+)*)"
-        pattern += r" *\$ *by definition of addition for functions"
-        match = re.fullmatch(pattern, s)
+        match = cls.natural_pattern.fullmatch(s)
         if not match:
             return None
         match1 = match[1]
-        match_match1 = re.fullmatch(r"(\w+)(?: *\+ *(\w+))*", match1)
+        match_match1 = cls.idents_pattern.fullmatch(match1)
         if not match_match1:
             return None
         idents = list(match_match1.groups())
         point = match[2]
         match3 = match[3]
-        match_match3 = re.fullmatch(r"(\w+)_(\w+)(?: *\+ *(?:(\w+)_(\w+))*)", match3)
+        match_match3 = cls.applied_pattern.fullmatch(match3)
         if not match_match3:
             return None
         for i in range(match_match3.lastindex):
@@ -714,24 +803,18 @@ class ByDefinitionOfAddFunction(Tactic):
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        pattern = r"have +(\w+) *: *\( *"
-        pattern += r"(\w+(?: *\+ *\w+)*)\)"
-        pattern += r" *(\w+)"
-        pattern += " *= *"
-        pattern += r"(\w+ +\w+(?: *\+ *\w+ +\w+))"
-        pattern += r" *:= *pi.add_apply +(\w+ +(?:\w+ +)\w+)"
-        match = re.fullmatch(pattern, s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         ident = match[1]
         match2 = match[2]
-        match_match2 = re.fullmatch(r"(\w+)(?: *\+ *(\w+))*", match2)
+        match_match2 = cls.idents_pattern.fullmatch(match2)
         if not match_match2:
             return None
         idents = list(match_match2.groups())
         point = match[3]
         match4 = match[4]
-        match_match4 = re.fullmatch(r"(\w+) +(\w+)(?: *\+ *\w+ +(\w+))", match4)
+        match_match4 = cls.lean_applied_pattern.fullmatch(match4)
         if not match_match4:
             return None
         for i in range(match_match4.lastindex):
@@ -746,6 +829,9 @@ class ByDefinitionOfAddFunction(Tactic):
 
 
 class GoalInequalityProperties(Tactic):
+    natural_pattern = re.compile(r" *By +inequality +properties *")
+    lean_pattern = re.compile(r" *obvious_ineq *")
+
     def to_lean(self) -> str:
         return "obvious_ineq"
 
@@ -754,14 +840,14 @@ class GoalInequalityProperties(Tactic):
 
     @classmethod
     def from_natural(cls, s: str, context=None, in_math=False):
-        match = re.fullmatch(r" *By +inequality +properties *", s)
+        match = cls.natural_pattern.fullmatch(s)
         if not match:
             return None
         return cls()
 
     @classmethod
     def from_lean(cls, s: str, context=None):
-        match = re.fullmatch(r" *obvious_ineq *", s)
+        match = cls.lean_pattern.fullmatch(s)
         if not match:
             return None
         return cls()
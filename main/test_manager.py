@@ -4,7 +4,6 @@ from django.test import TestCase
 
 import leanclient.client_wrapper as client_wrapper
 from main.manager import Manager, extract_goal, extract_error, extract_variable
-from main.views import write_to_lean
 
 sandwich_hyp = [
     "$a_n, b_n, c_n$ are real-valued sequences",
@@ -181,4 +180,5 @@ class SumLimitTest(TestCase):
         manager.set_initial_goal(sum_limit_goal)
         for proof in sum_limit_proof:
             manager.add_proof_line(proof)
-        write_to_lean(manager)
+        text, lines = manager.to_lean()
+        self.assertEqual(len(lines), len(sum_limit_proof) + 1)
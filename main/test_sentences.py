@@ -1,6 +1,8 @@
 from django.test import TestCase
 
 from main.context import Context
+from main.latex import tokenize, strip
+from main.language import NATURAL_INDEX, LEAN_INDEX, leading_token, parse_natural
 from main.sentences import (
     RealValuedSequences,
     RealDeclaration,
@@ -8,6 +10,9 @@ from main.sentences import (
     Inequality,
     ForAll,
     AbsoluteDiff,
+    Identifier,
+    Diff,
+    Div,
 )
 from main.test_utils import test_bijective
 
@@ -90,3 +95,104 @@ class AbsoluteDiffTest(TestCase):
         context.add("a", "sequence")
         context.add("b", "sequence")
         test_bijective(self, Inequality, natural, lean, context)
+
+
+class DiffTest(TestCase):
+    def test_spaces(self):
+        obj = Diff.from_natural(r"$ a -  \epsilon $")
+        self.assertEqual(obj.to_lean(), "a - ε")
+        self.assertIsNone(Diff.from_natural("a - b - c", Context(), True))
+
+
+class DivTest(TestCase):
+    def test_basic(self):
+        obj = Div.from_natural(r"\frac{ \epsilon}{2}", Context(), True)
+        self.assertEqual(obj.to_lean(), "ε / 2")
+        self.assertIsNone(Div.from_natural(r"\frac{  x}{2}", Context(), True))
+
+    def test_inequality(self):
+        natural = r"$\frac{\epsilon}{2} > 0$"
+        self.assertEqual(Inequality.from_natural(natural).to_lean(), "ε / 2 > 0")
+
+
+class LatexTest(TestCase):
+    def test_tokenize(self):
+        tokens = tokenize(r"\left|a_n - l\right| \leq 2")
+        expected = [r"\left", "|", "a_n", " ", "-", " ", "l", r"\right", "|"]
+        expected += [" ", r"\leq", " ", "2"]
+        self.assertEqual(tokens, expected)
+        self.assertEqual(strip([" ", "\t", "a", " ", "\n"]), ["a", " ", "\n"])
+
+    def test_one_inequality_symbol(self):
+        self.assertIsNone(Inequality.from_natural("$a < b < c$"))
+        self.assertIsNone(Inequality.from_natural("$a <b$"))
+
+    def test_long_expression(self):
+        natural = "|" + "-" * 10000
+        self.assertIsNone(AbsoluteDiff.from_natural(natural, Context(), True))
+
+
+class DispatchIndexTest(TestCase):
+    def test_leading_token(self):
+        self.assertEqual(leading_token("Let's choose $N$"), "Let's")
+        self.assertEqual(leading_token(r"\forall n"), r"\forall")
+        self.assertEqual(leading_token("$a_n$"), "$")
+        self.assertEqual(leading_token(""), "")
+
+    def test_candidates_keep_order(self):
+        languages = [SequenceLimit, Identifier, ForAll]
+        self.assertEqual(
+            NATURAL_INDEX.candidates("$l$", languages),
+            languages,
+        )
+        self.assertEqual(
+            LEAN_INDEX.candidates("is_limit a l", languages),
+            [SequenceLimit, Identifier],
+        )
+
+
+class ParseNaturalTest(TestCase):
+    def test_deferred_effects(self):
+        context = Context()
+        natural = "$a_n, b_n$ are real-valued sequences"
+        match, effects = parse_natural(natural, context, [RealValuedSequences])
+        self.assertEqual(match.to_lean(), "a b : ℕ → ℝ")
+        self.assertEqual(context.identifiers, {})
+        context.apply(effects)
+        self.assertEqual(context.get("b"), {"class": {"sequence"}})
+
+    def test_cached_result_depends_on_context(self):
+        languages = [Inequality]
+        natural = r"$a_n \leq l$"
+        match, _ = parse_natural(natural, Context(), languages)
+        self.assertEqual(match.to_lean(), "a_n ≤ l")
+        again, _ = parse_natural(natural, Context(), languages)
+        self.assertIs(again, match)
+        context = Context()
+        context.add("a", "sequence")
+        match, _ = parse_natural(natural, context, languages)
+        self.assertEqual(match.to_lean(), "a n ≤ l")
+
+
+class ContextSnapshotTest(TestCase):
+    def test_snapshot_is_independent(self):
+        context = Context()
+        context.add("a", "sequence")
+        snapshot = context.snapshot()
+        context.associate("a", "A1")
+        context.add("l", "real")
+        snapshot.add("b", "sequence")
+        self.assertEqual(snapshot.get("a"), {"class": {"sequence"}})
+        self.assertIsNone(snapshot.get("l"))
+        self.assertEqual(context.get("a"), {"class": {"sequence"}, "associate": "A1"})
+        self.assertIsNone(context.get("b"))
+
+    def test_layers_are_merged(self):
+        context = Context()
+        snapshots = []
+        for i in range(Context.MAX_LAYERS + 5):
+            context.associate("x", "A{}".format(i))
+            snapshots.append(context.snapshot())
+        self.assertLessEqual(len(context.layers), Context.MAX_LAYERS)
+        for i, snapshot in enumerate(snapshots):
+            self.assertEqual(snapshot.get("x"), {"associate": "A{}".format(i)})
@@ -1,8 +1,26 @@
+import csv
+import json
+import os
+import shlex
+import tempfile
+from io import StringIO
+from pathlib import Path
+
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import override_settings
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APITestCase
 
+from leanclient import client_wrapper
+from leanclient.pool import LeanServerPool
+from leanclient.tests import FAKE_LEAN
+from main.language import PARSE_CACHE
+from main.models import ProofForTheoremUser, ProofVerification, TheoremStatement
+from main.test_manager import sandwich_goal, sandwich_hyp, sandwich_proof
+from main.views import save_verification
+
 username = "testuser"
 password = "testpass"
 url_theorem_statements = "/theorem_statements/"
@@ -41,3 +59,219 @@ class AuthentificationTest(APITestCase):
         __incorrect({})
         __incorrect({"username": "a"})
         __incorrect({"password": "a"})
+
+
+class ProofVerificationTest(APITestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username=username, password=password)
+        self.statement = TheoremStatement.objects.create(
+            name="t", hypotheses="h", goal="g", owner=self.owner
+        )
+        self.proofs = []
+        for i in range(3):
+            user = User.objects.create_user(username="user{}".format(i))
+            proof = ProofForTheoremUser.objects.create(
+                user=user, theorem_statement=self.statement, proof="p{}".format(i)
+            )
+            save_verification(
+                proof,
+                {
+                    "status": "proofFinished",
+                    "detail": "",
+                    "initial_goal": {"value": "g", "isLean": True},
+                    "goals": [{"value": "", "isLean": True}],
+                },
+                1.5,
+            )
+            self.proofs.append(proof)
+
+    def test_list_with_verification(self):
+        self.client.force_authenticate(self.owner)
+        url = "/list_users_theorem_statement/{}/".format(self.statement.id)
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 3)
+        for res in response.data:
+            self.assertEqual(res["verification"]["status"], "proofFinished")
+            self.assertEqual(res["verification"]["elapsed"], 1.5)
+
+    def test_statement_change(self):
+        self.statement.goal = "other"
+        self.statement.save()
+        self.client.force_authenticate(self.owner)
+        url = "/list_users_theorem_statement/{}/".format(self.statement.id)
+        response = self.client.get(url)
+        self.assertIsNone(response.data[0]["verification"])
+
+    def test_update_invalidates(self):
+        proof = self.proofs[0]
+        self.client.force_authenticate(proof.user)
+        url = "/theorem_proof/{}/".format(proof.id)
+        self.client.patch(url, {"proof": "p0"}, format="json")
+        self.assertTrue(ProofVerification.objects.filter(proof=proof).exists())
+        response = self.client.patch(url, {"proof": "changed"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(ProofVerification.objects.filter(proof=proof).exists())
+
+    def test_grade_nothing(self):
+        out = StringIO()
+        call_command("grade_proofs", statement=self.statement.id + 1, stdout=out)
+        self.assertIn("No proof to grade", out.getvalue())
+
+
+class GradeProofsTest(APITestCase):
+    """grade_proofs with a fake Lean server, see benchmarks/fake_lean.py."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory.name)
+        Path("lean-project/src").mkdir(parents=True)
+        owner = User.objects.create_user(username=username, password=password)
+        self.statement = TheoremStatement.objects.create(
+            name="sandwich_grade",
+            hypotheses=json.dumps(sandwich_hyp),
+            goal=sandwich_goal,
+            owner=owner,
+        )
+        proofs = [sandwich_proof, sandwich_proof, ["Blah blah"]]
+        for i, proof in enumerate(proofs):
+            ProofForTheoremUser.objects.create(
+                user=User.objects.create_user(username="user{}".format(i)),
+                theorem_statement=self.statement,
+                proof=json.dumps(proof),
+            )
+
+    def test_grade(self):
+        out = StringIO()
+        call_command(
+            "grade_proofs",
+            statement=self.statement.id,
+            workers=1,
+            timeout=10,
+            output="grades.csv",
+            lean=shlex.join(FAKE_LEAN + ["--unchanged"]),
+            stdout=out,
+        )
+        statuses = sorted(ProofVerification.objects.values_list("status", flat=True))
+        self.assertEqual(
+            statuses, ["naturalToLeanError", "proofInProgress", "proofInProgress"]
+        )
+        with open("grades.csv", newline="", encoding="utf-8") as file:
+            rows = list(csv.DictReader(file))
+        self.assertEqual([row["user"] for row in rows], ["user0", "user1", "user2"])
+        self.assertEqual(rows[2]["detail"], "Unrecognized tactic Blah blah")
+        self.assertIn("proofInProgress: 2", out.getvalue())
+        self.assertIn("3 proofs graded", out.getvalue())
+
+
+class AskStateFakeLeanTest(APITestCase):
+    """AskState with a fake Lean server, see benchmarks/fake_lean.py."""
+
+    def setUp(self):
+        self.pool = client_wrapper._pool
+        client_wrapper._pool = LeanServerPool(1, FAKE_LEAN + ["--state", "⊢ true"])
+
+    def tearDown(self):
+        client_wrapper._pool.close()
+        client_wrapper._pool = self.pool
+
+    def test_ask_state(self):
+        data = {
+            "name": "sandwich_fake",
+            "hypotheses": sandwich_hyp,
+            "goal": sandwich_goal,
+            "proofs": sandwich_proof,
+        }
+        response = self.client.post(
+            "/ask_state/", data, format="json", HTTP_X_DEBUG_TIMINGS="1"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["status"], "proofInProgress")
+        self.assertEqual(len(response.data["goals"]), len(sandwich_proof))
+        self.assertEqual(response.data["hypotheses_ident"][2], "H1")
+        self.assertIn("full_sync", response.data["timings"])
+
+    def test_save_verification(self):
+        owner = User.objects.create_user(username=username, password=password)
+        statement = TheoremStatement.objects.create(
+            name="sandwich_fake",
+            hypotheses=json.dumps(sandwich_hyp),
+            goal=sandwich_goal,
+            owner=owner,
+        )
+        user = User.objects.create_user(username="student")
+        proof = ProofForTheoremUser.objects.create(
+            user=user, theorem_statement=statement, proof=json.dumps(sandwich_proof)
+        )
+        data = {
+            "name": "sandwich_fake",
+            "hypotheses": sandwich_hyp,
+            "goal": sandwich_goal,
+            "proofs": sandwich_proof[:-1],
+        }
+        self.client.force_authenticate(user)
+        # Not the stored proof
+        self.client.post("/ask_state/", data, format="json")
+        self.assertFalse(ProofVerification.objects.exists())
+        data["proofs"] = sandwich_proof
+        self.client.post("/ask_state/", data, format="json")
+        self.assertEqual(proof.verification.status, "proofInProgress")
+        self.assertTrue(proof.verification.is_current())
+        ProofVerification.objects.all().delete()
+        # The owner of the statement checking the proofs of its users
+        self.client.force_authenticate(owner)
+        response = self.client.post(
+            "/ask_state_batch/", {"items": [data]}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(ProofVerification.objects.get(proof=proof).is_current())
+
+
+class AskStateLimitsTest(APITestCase):
+    """Proofs rejected before any Lean work."""
+
+    def setUp(self):
+        self.pool = client_wrapper._pool
+        # Any use of Lean would fail
+        client_wrapper._pool = LeanServerPool(1, ["false"])
+        self.data = {
+            "name": "sandwich_limits",
+            "hypotheses": sandwich_hyp,
+            "goal": sandwich_goal,
+            "proofs": sandwich_proof,
+        }
+
+    def tearDown(self):
+        client_wrapper._pool.close()
+        client_wrapper._pool = self.pool
+
+    @override_settings(PROOF_MAX_LINES=5)
+    def test_too_many_lines(self):
+        response = self.client.post("/ask_state/", self.data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("hypotheses", response.data)
+        self.assertIn("proofs", response.data)
+
+    @override_settings(PROOF_MAX_LINE_LENGTH=30)
+    def test_line_too_long(self):
+        response = self.client.post("/ask_state/", self.data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertNotIn("name", response.data)
+        self.assertIn("hypotheses", response.data)
+
+    @override_settings(PROOF_MAX_TOTAL_LENGTH=100)
+    def test_payload_too_long(self):
+        response = self.client.post("/ask_state/", self.data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("non_field_errors", response.data)
+
+    @override_settings(PROOF_LINE_PARSE_BUDGET=-1)
+    def test_parse_budget(self):
+        PARSE_CACHE.clear()
+        response = self.client.post("/ask_state/", self.data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["status"], "naturalToLeanError")
+        self.assertIn("took too long", response.data["detail"])
@@ -4,6 +4,10 @@ from main import views
 
 urlpatterns = [
     path("ask_state/", views.AskState.as_view()),
+    path("ask_state_async/", views.ask_state_async),
+    path("ask_state_stream/", views.AskStateStream.as_view()),
+    path("ask_state_batch/", views.AskStateBatch.as_view()),
+    path("metrics/", views.Metrics.as_view()),
     path("owned_theorem_statements/", views.OwnedTheoremStatementsViewSet.as_view()),
     path(
         "owned_theorem_statement/<int:pk>/",
@@ -1,24 +1,33 @@
+import json
+import time
+
 from django.contrib.auth.models import User
+from django.db.models import Q
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
 from rest_framework import generics
 from rest_framework import status
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from leanclient import client_wrapper
+from leanclient.exceptions import LeanTimeoutError, LeanBusyError
+from leanclient.timing import Timings
 from main.exceptions import NaturalToLeanError, LeanToNaturalError
+from main.language import PARSE_CACHE
 from main.manager import (
     Manager,
-    extract_goals,
+    extract_goal,
     extract_variable,
     extract_error,
     lean_variable_to_nat,
     lean_goal_to_nat,
     is_accomplished,
 )
-from main.models import TheoremStatement, ProofForTheoremUser
+from main.models import TheoremStatement, ProofForTheoremUser, ProofVerification
 from main.serializers import (
     AskStateSerializer,
+    AskStateBatchSerializer,
     TheoremStatementSerializer,
     UserSerializer,
     CreateProofForTheoremUserSerializer,
@@ -28,8 +37,12 @@ from main.serializers import (
 )
 
 
-def add_all_manager(name, goal, hypotheses, proofs):
-    manager = Manager()
+# Requests with this header get the time of each stage in their result
+TIMINGS_HEADER = "HTTP_X_DEBUG_TIMINGS"
+
+
+def add_all_manager(name, goal, hypotheses, proofs, timings=None):
+    manager = Manager(timings)
     manager.theorem_name = name
     for hyp in hypotheses:
         manager.add_hypothesis(hyp)
@@ -39,59 +52,46 @@ def add_all_manager(name, goal, hypotheses, proofs):
     return manager
 
 
-def write_to_lean(manager):
-    file = open(client_wrapper.LEAN_DIR_SRC + "result.lean", "w", encoding="utf-8")
+def get_goal(state, context):
+    goal = extract_goal(state)
+    if not goal:
+        return {"value": "", "isLean": False}
     try:
-        text, lines = manager.to_lean()
-        file.write(text)
-    finally:
-        file.close()
-    return text, lines
+        return {"value": lean_goal_to_nat(goal, context), "isLean": False}
+    except LeanToNaturalError:
+        return {"value": goal, "isLean": True}
 
 
 def get_goals(manager, states):
-    goals = extract_goals(states)
-    initial_goal = goals[0]
-    goals = goals[1:]
-    if initial_goal:
-        try:
-            initial_goal = lean_goal_to_nat(initial_goal, manager.initial_context)
-            initial_goal = {"value": initial_goal, "isLean": False}
-        except LeanToNaturalError:
-            initial_goal = {"value": initial_goal, "isLean": True}
-    else:
-        initial_goal = {"value": "", "isLean": False}
+    initial_goal = get_goal(states[0], manager.initial_context)
     goals_nat = []
-    for i in range(len(goals)):
-        if goals[i]:
+    for i in range(len(states) - 1):
+        goals_nat.append(get_goal(states[i + 1], manager.contexts[i]))
+    return initial_goal, goals_nat
+
+
+def get_line_sentences(manager, i, state):
+    """Sentences introduced by the i-th proof line, given the state after it."""
+    cur_sentences = []
+    for ident in manager.to_extract[i]:
+        sentence = extract_variable(state, ident)
+        if sentence:
+            is_lean = False
             try:
-                goal = lean_goal_to_nat(goals[i], manager.contexts[i])
-                goal = {"value": goal, "isLean": False}
+                sentence = lean_variable_to_nat(sentence, manager.contexts[i])
             except LeanToNaturalError:
-                goal = {"value": goals[i], "isLean": True}
-        else:
-            goal = {"value": "", "isLean": False}
-        goals_nat.append(goal)
-    return initial_goal, goals_nat
+                is_lean = True
+            cur_sentences.append(
+                {"ident": ident, "sentence": sentence, "isLean": is_lean}
+            )
+    return cur_sentences
 
 
 def get_sentences(manager, states):
     states = states[1:]  # don't take the initial goal state
     sentences = []
     for i in range(len(states)):
-        cur_sentences = []
-        for ident in manager.to_extract[i]:
-            sentence = extract_variable(states[i], ident)
-            if sentence:
-                is_lean = False
-                try:
-                    sentence = lean_variable_to_nat(sentence, manager.contexts[i])
-                except LeanToNaturalError:
-                    is_lean = True
-                cur_sentences.append(
-                    {"ident": ident, "sentence": sentence, "isLean": is_lean}
-                )
-        sentences.append(cur_sentences)
+        sentences.append(get_line_sentences(manager, i, states[i]))
     return sentences
 
 
@@ -103,59 +103,346 @@ def get_hypotheses_ident(manager):
     return manager.ident_hypotheses()
 
 
+def get_timeout_detail(lines, line):
+    # lines[0] is the beginning of the proof, lines[i] the i-th proof line
+    if line is not None:
+        for i in range(1, len(lines)):
+            if lines[i] >= line:
+                return "Lean did not finish in time, it stopped at proof line {}".format(
+                    i
+                )
+    return "Lean did not finish in time"
+
+
+def get_failure_result(status_proof, detail):
+    return {
+        "status": status_proof,
+        "detail": detail,
+        "hypotheses_ident": [],
+        "initial_goal": {"value": "", "isLean": False},
+        "goals": [],
+        "sentences": [],
+    }
+
+
+def get_natural_to_lean_error(e):
+    return get_failure_result("naturalToLeanError", "{}".format(e))
+
+
+def get_busy_error(e):
+    res = get_failure_result("busy", "Too many proofs are being checked, retry later")
+    res["retryAfter"] = e.retry_after
+    return res
+
+
+def get_proof_status(lines, states, goals, err, timeout=None):
+    status_proof = "proofInProgress"
+    detail = ""
+    if timeout:
+        status_proof = "leanTimeout"
+        detail = get_timeout_detail(lines, timeout.line)
+    elif err:
+        err = extract_error(err)
+        if err != "tactic failed, there are unsolved goals":
+            status_proof = "leanError"
+            detail = err
+    else:
+        if goals and goals[-1]["value"] == "":
+            if is_accomplished(states[-1]):
+                status_proof = "proofFinished"
+    return status_proof, detail
+
+
+def get_ask_state_result(manager, lines, states, err, timeout=None):
+    hypotheses_ident = get_hypotheses_ident(manager)
+    initial_goal, goals = get_goals(manager, states)
+    sentences = get_sentences(manager, states)
+    status_proof, detail = get_proof_status(lines, states, goals, err, timeout)
+    return {
+        "status": status_proof,
+        "hypotheses_ident": hypotheses_ident,
+        "initial_goal": initial_goal,
+        "goals": goals,
+        "sentences": sentences,
+        "detail": detail,
+    }
+
+
+def save_verification(proof, result, elapsed):
+    """Remember the result of the check of a stored proof."""
+    goal = result["goals"][-1] if result["goals"] else result["initial_goal"]
+    error = "" if result["status"] == "proofInProgress" else result["detail"]
+    ProofVerification.objects.update_or_create(
+        proof=proof,
+        defaults={
+            "content_hash": proof.content_hash(),
+            "status": result["status"],
+            "goal": goal["value"],
+            "error": error,
+            "elapsed": elapsed,
+        },
+    )
+
+
+def save_checked_verifications(user, checks, elapsed):
+    """Save the result of each (input, result) check as the verification of
+    the stored proofs it is a check of, among the proofs of the user and of
+    the statements the user owns."""
+    if not user.is_authenticated:
+        return
+    proofs = ProofForTheoremUser.objects.select_related("theorem_statement").filter(
+        Q(user=user) | Q(theorem_statement__owner=user),
+        theorem_statement__name__in={data["name"] for data, _ in checks},
+    )
+    for proof in proofs:
+        for data, result in checks:
+            if proof.has_content(
+                data["name"], data["hypotheses"], data["goal"], data["proofs"]
+            ):
+                save_verification(proof, result, elapsed)
+                break
+
+
+def add_all_manager_from(validated_data, timings=None):
+    return add_all_manager(
+        validated_data["name"],
+        validated_data["goal"],
+        validated_data["hypotheses"],
+        validated_data["proofs"],
+        timings,
+    )
+
+
+def add_timings(request, res, timings, start):
+    """Record the timings of a check, and add them to its result if asked."""
+    timings.add("total", time.perf_counter() - start)
+    timings.record()
+    if request.META.get(TIMINGS_HEADER):
+        res["timings"] = timings.as_milliseconds()
+    return res
+
+
 class AskState(APIView):
     permission_classes = [AllowAny]
 
     def post(self, request, format=None):
+        start = time.perf_counter()
+        timings = Timings()
         serializer = AskStateSerializer(data=request.data)
         if serializer.is_valid():
             try:
-                manager = add_all_manager(
-                    serializer.validated_data["name"],
-                    serializer.validated_data["goal"],
-                    serializer.validated_data["hypotheses"],
-                    serializer.validated_data["proofs"],
-                )
+                manager = add_all_manager_from(serializer.validated_data, timings)
             except NaturalToLeanError as e:
+                res = get_natural_to_lean_error(e)
+                save_checked_verifications(
+                    request.user, [(serializer.validated_data, res)], 0
+                )
+                return Response(res, status=status.HTTP_400_BAD_REQUEST)
+            text, lines = manager.to_lean()
+            timeout = None
+            try:
+                states, err = client_wrapper.states_text(
+                    text, lines, serializer.validated_data.get("session"), timings
+                )
+            except LeanTimeoutError as e:
+                states, err, timeout = e.states, e.err, e
+            except LeanBusyError as e:
                 return Response(
-                    {
-                        "status": "naturalToLeanError",
-                        "detail": "{}".format(e),
-                        "hypotheses_ident": [],
-                        "initial_goal": {"value": "", "isLean": False},
-                        "goals": [],
-                        "sentences": [],
-                    },
-                    status=status.HTTP_400_BAD_REQUEST,
+                    get_busy_error(e),
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    headers={"Retry-After": str(e.retry_after)},
                 )
-            text, lines = write_to_lean(manager)
-            states, err = client_wrapper.states("result.lean", lines)
-            hypotheses_ident = get_hypotheses_ident(manager)
-            initial_goal, goals = get_goals(manager, states)
-            sentences = get_sentences(manager, states)
-            status_proof = "proofInProgress"
-            detail = ""
-            if err:
-                err = extract_error(err)
-                if err != "tactic failed, there are unsolved goals":
-                    status_proof = "leanError"
-                    detail = err
-            else:
-                if goals and goals[-1]["value"] == "":
-                    if is_accomplished(states[-1]):
-                        status_proof = "proofFinished"
-            res = {
-                "status": status_proof,
-                "hypotheses_ident": hypotheses_ident,
-                "initial_goal": initial_goal,
-                "goals": goals,
-                "sentences": sentences,
-                "detail": detail,
-            }
+            with timings.span("back_translation"):
+                res = get_ask_state_result(manager, lines, states, err, timeout)
+            save_checked_verifications(
+                request.user,
+                [(serializer.validated_data, res)],
+                time.perf_counter() - start,
+            )
+            add_timings(request, res, timings, start)
             return Response(res, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+async def ask_state_async(request):
+    """Same as AskState, but waits for Lean without blocking the event loop
+    when served through ASGI."""
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse(
+            {"detail": "JSON parse error"}, status=status.HTTP_400_BAD_REQUEST
+        )
+    start = time.perf_counter()
+    timings = Timings()
+    serializer = AskStateSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        manager = add_all_manager_from(serializer.validated_data, timings)
+    except NaturalToLeanError as e:
+        return JsonResponse(
+            get_natural_to_lean_error(e),
+            status=status.HTTP_400_BAD_REQUEST,
+            json_dumps_params={"ensure_ascii": False},
+        )
+    text, lines = manager.to_lean()
+    timeout = None
+    try:
+        states, err = await client_wrapper.states_text_asyncio(
+            text, lines, serializer.validated_data.get("session"), timings
+        )
+    except LeanTimeoutError as e:
+        states, err, timeout = e.states, e.err, e
+    except LeanBusyError as e:
+        response = JsonResponse(
+            get_busy_error(e), status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        response["Retry-After"] = str(e.retry_after)
+        return response
+    with timings.span("back_translation"):
+        res = get_ask_state_result(manager, lines, states, err, timeout)
+    add_timings(request, res, timings, start)
+    return JsonResponse(
+        res, status=status.HTTP_200_OK, json_dumps_params={"ensure_ascii": False}
+    )
+
+
+# csrf_exempt would wrap the coroutine function in a synchronous view
+ask_state_async.csrf_exempt = True
+
+
+def server_sent_event(event, data):
+    return "event: {}\ndata: {}\n\n".format(
+        event, json.dumps(data, ensure_ascii=False)
+    )
+
+
+def stream_ask_state(manager, lines, updates, future):
+    """Server-sent events giving the goal and sentences of each proof line as
+    soon as Lean gives its state, and then the status of the proof."""
+    yield server_sent_event(
+        "hypotheses", {"hypotheses_ident": get_hypotheses_ident(manager)}
+    )
+    for i, state in updates:
+        if i == 0:
+            goal = get_goal(state, manager.initial_context)
+            yield server_sent_event("initial_goal", {"initial_goal": goal})
+        else:
+            goal = get_goal(state, manager.contexts[i - 1])
+            sentences = get_line_sentences(manager, i - 1, state)
+            yield server_sent_event(
+                "line", {"index": i - 1, "goal": goal, "sentences": sentences}
+            )
+    timeout = None
+    try:
+        states, err = future.result()
+    except LeanTimeoutError as e:
+        states, err, timeout = e.states, e.err, e
+    except LeanBusyError as e:
+        # No Lean server came in time
+        yield server_sent_event("status", get_busy_error(e))
+        return
+    goals = [get_goal(states[i + 1], manager.contexts[i]) for i in range(len(states) - 1)]
+    status_proof, detail = get_proof_status(lines, states, goals, err, timeout)
+    yield server_sent_event("status", {"status": status_proof, "detail": detail})
+
+
+class AskStateStream(APIView):
+    """AskState streaming its result as server-sent events."""
+
+    permission_classes = [AllowAny]
+
+    def post(self, request, format=None):
+        serializer = AskStateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            manager = add_all_manager_from(serializer.validated_data)
+        except NaturalToLeanError as e:
+            return Response(
+                get_natural_to_lean_error(e), status=status.HTTP_400_BAD_REQUEST,
+            )
+        text, lines = manager.to_lean()
+        try:
+            updates, future = client_wrapper.stream_states_text(
+                text, lines, serializer.validated_data.get("session")
+            )
+        except LeanBusyError as e:
+            return Response(
+                get_busy_error(e),
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(e.retry_after)},
+            )
+        response = StreamingHttpResponse(
+            stream_ask_state(manager, lines, updates, future),
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        # Keep nginx from holding the events back until the end
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
+class AskStateBatch(APIView):
+    """AskState for a list of proofs, for example all the proofs of a
+    statement. The proofs are checked a few at a time by the Lean servers and
+    the results are given in the same order."""
+
+    def post(self, request, format=None):
+        start = time.perf_counter()
+        serializer = AskStateBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        items = serializer.validated_data["items"]
+        results = []
+        checked = []
+        for item in items:
+            try:
+                manager = add_all_manager_from(item)
+            except NaturalToLeanError as e:
+                results.append(get_natural_to_lean_error(e))
+                continue
+            text, lines = manager.to_lean()
+            checked.append((len(results), manager, text, lines))
+            results.append(None)
+        try:
+            lean_results = client_wrapper.states_texts(
+                [(text, lines) for _, _, text, lines in checked]
+            )
+        except LeanBusyError as e:
+            return Response(
+                get_busy_error(e),
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(e.retry_after)},
+            )
+        for (i, manager, _, lines), res in zip(checked, lean_results):
+            if isinstance(res, LeanTimeoutError):
+                results[i] = get_ask_state_result(
+                    manager, lines, res.states, res.err, res
+                )
+            else:
+                results[i] = get_ask_state_result(manager, lines, *res)
+        # The time of a check is not known inside a batch, its share is saved
+        elapsed = (time.perf_counter() - start) / len(items)
+        save_checked_verifications(request.user, list(zip(items, results)), elapsed)
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+class Metrics(APIView):
+    """Histograms of the time taken by each stage of the checks, and state of
+    the Lean pool and of the caches of this process."""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, format=None):
+        stats = client_wrapper.stats()
+        stats["parse_cache"] = PARSE_CACHE.stats()
+        return Response(stats, status=status.HTTP_200_OK)
+
+
 class OwnedTheoremStatementsViewSet(generics.ListCreateAPIView):
     serializer_class = TheoremStatementSerializer
 
@@ -195,7 +482,7 @@ class ListUsersStatementViewSet(generics.ListAPIView):
     def get_queryset(self):
         return ProofForTheoremUser.objects.filter(
             theorem_statement__owner=self.request.user
-        )
+        ).select_related("user", "theorem_statement", "verification")
 
 
 class DeleteUserStatementViewSet(generics.DestroyAPIView):
@@ -226,6 +513,12 @@ class ProofViewSet(generics.RetrieveUpdateAPIView):
     def get_queryset(self):
         return ProofForTheoremUser.objects.filter(user=self.request.user)
 
+    def perform_update(self, serializer):
+        old_proof = serializer.instance.proof
+        proof = serializer.save()
+        if proof.proof != old_proof:
+            ProofVerification.objects.filter(proof=proof).delete()
+
 
 class ListTheoremProofsViewSet(generics.ListAPIView):
     serializer_class = LightProofForTheoremUserSerializer